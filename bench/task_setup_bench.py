@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+#/* Part of the Maestro sequencer software package.
+# * Copyright (C) 2011-2015  Canadian Meteorological Centre
+# *                          Environment Canada
+# *
+# * Maestro is free software; you can redistribute it and/or
+# * modify it under the terms of the GNU Lesser General Public
+# * License as published by the Free Software Foundation,
+# * version 2.1 of the License.
+# *
+# * Maestro is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# * Lesser General Public License for more details.
+# *
+# * You should have received a copy of the GNU Lesser General Public
+# * License along with this library; if not, write to the
+# * Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# * Boston, MA 02111-1307, USA.
+# */
+
+#-------------------------------------------------------------------
+# task_setup_bench.py
+#
+# Benchmark suite for the task setup utility
+#-------------------------------------------------------------------
+
+"""Measure the performance of task_setup.py on synthetic configurations
+
+Each scenario generates a configuration file and the data it refers to
+in a scratch directory, then times Config.getSections() and Config.link()
+in-process over several repetitions.  Remote 'host:' targets are served
+by a local stand-in for ssh and external path resolution by a stand-in
+for true_path, so that the suite runs on any Linux box without network
+access.  Caches are emptied between repetitions unless --warm is given.
+
+Results can be saved as a baseline (--save) and are compared with the
+stored baseline on later runs; a scenario that is slower than its
+baseline by more than the tolerance is reported as a regression and
+makes the suite exit with a non-zero status.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import optparse
+import json
+import socket
+from time import time
+
+# Scenario definitions: sections, entries per section, loop length, and the fraction of
+# entries that use embedded commands, wildcards (with the given fan-out) and remote targets
+scenarios = {'small':    {'sections':1,'entries':20,  'loop':0,  'embedded':0.,  'wildcard':0.,  'fanout':0, 'remote':0.},
+             'wide':     {'sections':3,'entries':1000,'loop':0,  'embedded':0.,  'wildcard':0.,  'fanout':0, 'remote':0.},
+             'loops':    {'sections':2,'entries':10,  'loop':200,'embedded':0.,  'wildcard':0.,  'fanout':0, 'remote':0.},
+             'embedded': {'sections':1,'entries':200, 'loop':0,  'embedded':0.5, 'wildcard':0.,  'fanout':0, 'remote':0.},
+             'fanout':   {'sections':1,'entries':50,  'loop':0,  'embedded':0.,  'wildcard':0.5, 'fanout':50,'remote':0.},
+             'remote':   {'sections':1,'entries':200, 'loop':0,  'embedded':0.,  'wildcard':0.1, 'fanout':10,'remote':0.5},
+             'mixed':    {'sections':3,'entries':200, 'loop':20, 'embedded':0.1, 'wildcard':0.1, 'fanout':10,'remote':0.1}}
+
+class Workspace(object):
+    """Scratch directory holding the stand-in executables, data and task directories"""
+
+    # Class variables
+    ssh = '#!/bin/sh\n# Local stand-in for ssh: drop the host and run the command locally\nshift\nexec /bin/sh -c "$*"\n'
+    true_path = '#!/bin/sh\n# Local stand-in for true_path\nif [ -e "$1" ] ; then printf \'%s\' "$(readlink -f "$1")" ; ' + \
+                'else echo "$1: No such file or directory" ; fi\n'
+    cachegen = '#!/bin/sh\n# Local stand-in for task_setup_cachegen (generated configurations define no variables)\n: > "$2"\n'
+
+    def __init__(self,directory=None):
+        """Class constructor"""
+        self.directory = directory and os.path.abspath(directory) or tempfile.mkdtemp(prefix='task_setup_bench.')
+        self.bin = os.path.join(self.directory,'bin')
+        self.data = os.path.join(self.directory,'data')
+        for subdir in (self.bin,self.data):
+            if not os.path.isdir(subdir): os.makedirs(subdir)
+        for (name,contents) in (('ssh',self.ssh),('true_path',self.true_path),('task_setup_cachegen',self.cachegen)):
+            path = os.path.join(self.bin,name)
+            fd = open(path,'w')
+            fd.write(contents)
+            fd.close()
+            os.chmod(path,0755)
+
+    def environment(self):
+        """Point the environment at the stand-ins and the generated data"""
+        os.environ['PATH'] = self.bin+':'+os.environ.get('PATH','/bin:/usr/bin')
+        os.environ['TASK_SETUP_RSH'] = os.path.join(self.bin,'ssh')
+        os.environ['BENCH_DATA'] = self.data
+
+    def remove(self):
+        """Remove the scratch directory"""
+        shutil.rmtree(self.directory,ignore_errors=True)
+
+class ConfigGenerator(object):
+    """Writer of synthetic configuration files and the data files they refer to"""
+
+    def __init__(self,workspace,name,params):
+        """Class constructor"""
+        self.workspace = workspace
+        self.name = name
+        self.params = params
+
+    def _every(self,fraction,i):
+        """Deterministically select a fraction of the entries"""
+        if fraction <= 0.: return(False)
+        return(int((i+1)*fraction) != int(i*fraction))
+
+    def _touch(self,path):
+        """Create an empty data file"""
+        if not os.path.exists(path): open(path,'w').close()
+
+    def write(self):
+        """Generate the configuration file and its data, returning the configuration file name"""
+        params = self.params
+        data = self.workspace.data
+        lines = ['#############################################\n']
+        for s in range(0,params['sections']):
+            section = (s == 0) and 'input' or 'input'+str(s)
+            if s == 1 and params['loop'] > 0:
+                lines.append('# <%s type=loop var=step start=0000 end=%04d>\n' % (section,params['loop']-1))
+                for i in range(0,params['entries']):
+                    self._touch(os.path.join(data,'f%04d.dat' % i))
+                    lines.append('# l%04d_${step}   ${BENCH_DATA}/f%04d.dat\n' % (i,i))
+                lines.append('# </%s>\n' % section)
+                continue
+            lines.append('# <%s>\n' % section)
+            for i in range(0,params['entries']):
+                self._touch(os.path.join(data,'f%04d.dat' % i))
+                target = '${BENCH_DATA}/f%04d.dat' % i
+                link = 'e%04d' % i
+                if self._every(params['wildcard'],i):
+                    fan = os.path.join(data,'fan%04d' % i)
+                    if not os.path.isdir(fan): os.mkdir(fan)
+                    for j in range(0,params['fanout']):
+                        self._touch(os.path.join(fan,'g%04d.dat' % j))
+                    target = '${BENCH_DATA}/fan%04d/g*.dat' % i
+                    link += '/'
+                if self._every(params['embedded'],i):
+                    target = '`echo '+target+'`'
+                elif self._every(params['remote'],i):
+                    target = 'localhost:'+target
+                lines.append('# %s   %s\n' % (link,target))
+            lines.append('# </%s>\n' % section)
+        lines.extend(['# <executables>\n','# sh   sh\n','# ls   ls\n','# </executables>\n'])
+        cfg = os.path.join(self.workspace.directory,self.name+'.cfg')
+        fd = open(cfg,'w')
+        fd.writelines(lines)
+        fd.close()
+        return(cfg)
+
+class Benchmark(object):
+    """Timing of the parse and link phases of task_setup.py for a scenario"""
+
+    def __init__(self,task_setup,workspace,name,params,repeat=5,warm=False):
+        """Class constructor"""
+        self.ts = task_setup
+        self.workspace = workspace
+        self.name = name
+        self.params = params
+        self.repeat = repeat
+        self.warm = warm
+
+    def _coldCaches(self):
+        """Empty the in-process caches of the task setup module"""
+        for cache in (self.ts.embeddedCache,self.ts.namespaceCache,self.ts.configCache,self.ts.keywordTemplates,self.ts.pathIndex):
+            cache.clear()
+        self.ts.pathIndex.listings.clear()
+        self.ts.truePathResolver.reset()
+        self.ts.remoteSessions.close()
+
+    def _median(self,values):
+        """Median of a list of values"""
+        values = sorted(values)
+        middle = len(values)/2
+        return((len(values)%2) and values[middle] or 0.5*(values[middle-1]+values[middle]))
+
+    def run(self):
+        """Time the scenario, returning its results"""
+        cfg_file = ConfigGenerator(self.workspace,self.name,self.params).write()
+        taskdir = os.path.join(self.workspace.directory,'task_'+self.name)
+        parse = []
+        link = []
+        entries = 0
+        saved = (sys.stdout,sys.stderr)
+        null = open(os.devnull,'w')
+        try:
+            for i in range(0,self.repeat):
+                if os.path.isdir(taskdir): shutil.rmtree(taskdir)
+                if not self.warm: self._coldCaches()
+                self.ts.undef_list = self.ts.Store()
+                (sys.stdout,sys.stderr) = (null,null)
+                try:
+                    start = time()
+                    cfg = self.ts.Config(file=cfg_file,taskdir=taskdir)
+                    cfg.getSections()
+                    parsed = time()
+                    cfg.link()
+                    linked = time()
+                finally:
+                    (sys.stdout,sys.stderr) = saved
+                entries = sum([len(section) for section in cfg["sections"].values()])
+                del cfg
+                parse.append(parsed-start)
+                link.append(linked-parsed)
+        finally:
+            null.close()
+        total = self._median([parse[i]+link[i] for i in range(0,len(parse))])
+        return({'entries':entries,
+                'parse':self._median(parse),
+                'link':self._median(link),
+                'total':total,
+                'throughput':total > 0 and entries/total or 0.})
+
+def loadBaseline(path):
+    """Read stored baseline results"""
+    try:
+        fd = open(path,'r')
+        try:
+            return(json.load(fd))
+        finally:
+            fd.close()
+    except (IOError,ValueError):
+        return({})
+
+def saveBaseline(path,baseline):
+    """Write baseline results"""
+    fd = open(path,'w')
+    try:
+        json.dump(baseline,fd,indent=1,sort_keys=True)
+    finally:
+        fd.close()
+
+# Executable segment
+if __name__ == "__main__":
+
+    # Command line argument parsing
+    usage = "%prog [options] [SCENARIO ...]\n\nScenarios: "+', '.join(sorted(scenarios.keys()))
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option("-n","--repeat",dest="repeat",type="int",default=5,
+                      help="number of timed repetitions per scenario (5)",metavar="N")
+    parser.add_option("-w","--warm",dest="warm",action="store_true",default=False,
+                      help="keep the task setup caches between repetitions")
+    parser.add_option("-b","--baseline",dest="baseline",
+                      default=os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),'baseline-'+socket.gethostname()+'.json'),
+                      help="baseline FILE to compare with (machine specific by default)",metavar="FILE")
+    parser.add_option("-s","--save",dest="save",action="store_true",default=False,
+                      help="save the results as the new baseline")
+    parser.add_option("-t","--tolerance",dest="tolerance",type="float",default=0.2,
+                      help="relative slowdown reported as a regression (0.2)",metavar="FRACTION")
+    parser.add_option("-k","--keep",dest="keep",default=None,
+                      help="generate the scenarios in DIRECTORY and keep it",metavar="DIRECTORY")
+    parser.add_option("-x","--external-truepath",dest="external",action="store_true",default=False,
+                      help="resolve paths with the true_path stand-in instead of in-process")
+    (options,args) = parser.parse_args()
+    names = args and args or sorted(scenarios.keys())
+    for name in names:
+        if not scenarios.has_key(name):
+            parser.error("unknown scenario "+name)
+
+    # Prepare the environment before the task setup module reads it
+    workspace = Workspace(options.keep)
+    workspace.environment()
+    if options.external: os.environ['TASK_SETUP_EXTERNAL_TRUEPATH'] = '1'
+    sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))),'bin'))
+    sys.argv = [os.path.join(sys.path[0],'task_setup.py')]
+    import task_setup
+
+    # Run the scenarios and compare with the baseline
+    baseline = loadBaseline(options.baseline)
+    results = {}
+    regressions = []
+    print "%-10s %8s %11s %11s %11s %13s  %s" % ('scenario','entries','parse(ms)','link(ms)','total(ms)','entries/s','vs baseline')
+    try:
+        for name in names:
+            result = Benchmark(task_setup,workspace,name,scenarios[name],repeat=options.repeat,warm=options.warm).run()
+            results[name] = result
+            comparison = ''
+            if baseline.has_key(name) and baseline[name]['total'] > 0:
+                ratio = result['total']/baseline[name]['total']
+                comparison = "%.2fx" % ratio
+                if ratio > 1.+options.tolerance:
+                    comparison += ' REGRESSION'
+                    regressions.append(name)
+            print "%-10s %8d %11.2f %11.2f %11.2f %13.0f  %s" % (name,result['entries'],1e3*result['parse'],1e3*result['link'],
+                                                                 1e3*result['total'],result['throughput'],comparison)
+            sys.stdout.flush()
+    finally:
+        task_setup.remoteSessions.close()
+        if not options.keep: workspace.remove()
+    if options.save:
+        baseline.update(results)
+        saveBaseline(options.baseline,baseline)
+        print "Saved baseline to "+options.baseline
+    sys.exit(regressions and 1 or 0)
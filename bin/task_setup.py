@@ -48,7 +48,8 @@ CONFIG CLASS
     cfg.link() - Generate the subdirectories and links to the files
          identified in the config file.
     cfg.setOption(option,value) - Set the named option ('delimiter_exec',
-         'verbosity','cleanup','force') to the value specified in the argument.
+         'verbosity','cleanup','force','jobs','incremental','clean_mode',
+         'copy_method','remote_expansions','keep_inputs') to the value specified in the argument.
          This method should be called before the 'getSections' method
          to ensure that keywords are properly resolved.
 
@@ -63,6 +64,23 @@ CONFIG CLASS
     verbosity  - Integer to control verbosity level.
     cleanup    - Boolean to clean task directory before setup.
     force      - Boolean to force actions despite warnings.
+    jobs       - Number of section entries to link concurrently.
+    incremental - Boolean to update the task directory from the manifest of
+         the previous setup instead of recreating all entries.
+    clean_mode - Cleanup strategy: 'remove' deletes old task subdirectories
+         in place, 'trash' renames them into a trash directory next to the
+         task directory and deletes them in the background.
+    copy_method - Default method for copy entries ('auto', 'hardlink',
+         'reflink', 'range' or 'stream').  Each method falls back to the
+         following ones when the filesystem does not support it; 'auto'
+         starts with 'reflink'.  Sections select their own method (and
+         copy rather than link their entries) with a 'copy_method'
+         header attribute.
+    remote_expansions - Dictionary of remote wildcard expansions shared
+         by the configurations of a batch (None to expand for each one).
+    keep_inputs - Boolean to copy rather than move the set and variable
+         cache files into the .setup subdirectory (batch setups, whose
+         lines may share these files).
     error      - Error code for return.
     ok         - Successful completion code for return.
 
@@ -82,6 +100,13 @@ SECTION CLASS
     verbosity        - Integer to control verbosity level.
     cleanup          - Boolean to clean task directory before setup.
     force            - Force action despite warnings.
+
+ENTRY CLASS
+
+    Each element of a section is an 'Entry' record describing one link
+    or copy ('link', 'target', 'target_host', 'target_type', 'copy',
+    'cleanup', ...).  Its fields are attributes that can also be read
+    as mapping keys (entry["link"], entry.get("copy_method")).
 """
 
 __version__ = "0.16.0"
@@ -92,6 +117,7 @@ __author__  = "Ron McTaggart-Cowan (ron.mctaggart-cowan@ec.gc.ca)"
 #---------
 import os
 import sys
+import errno
 import shutil
 import re
 import optparse
@@ -99,7 +125,16 @@ import tempfile
 import types
 import shlex
 import copy
+import json
+import atexit
+import threading
+import Queue
+import hashlib
+import cPickle
+import collections
+import socket
 from time import time
+from stat import S_ISDIR,S_ISLNK
 
 class Store(object):
     """Space for saving values using a callable object"""
@@ -110,10 +145,111 @@ class Store(object):
         """Add an entry to the saved space"""
         self.saved.append(value)
         
+class Profiler(object):
+    """Wall time and call counts of the phases of a task setup"""
+
+    # Class variables
+    summary_name = 'task_setup_profile.json'
+    trace_name = 'task_setup_trace.json'
+
+    class Span(object):
+        """Timed block of code"""
+        def __init__(self,profiler,name,args):
+            """Class constructor"""
+            self.profiler = profiler
+            self.name = name
+            self.args = args
+        def __enter__(self):
+            """Start the timer"""
+            self.start = time()
+            return(self)
+        def __exit__(self,exc_type,exc_value,traceback):
+            """Stop the timer and record the span"""
+            self.profiler.record(self.name,self.start,time(),self.args)
+            return(False)
+
+    class NullSpan(object):
+        """Untimed block of code (profiling disabled)"""
+        def __enter__(self):
+            return(self)
+        def __exit__(self,exc_type,exc_value,traceback):
+            return(False)
+
+    def __init__(self):
+        """Class constructor"""
+        self.null = self.NullSpan()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self,enabled=False,trace=False):
+        """Discard the measurements made so far and start a new profile"""
+        self.enabled = enabled or trace
+        self.trace = trace
+        self.origin = time()
+        self.phases = {}
+        self.events = []
+
+    def span(self,name,**args):
+        """Return a context manager that times a block of code"""
+        if not self.enabled: return(self.null)
+        return(self.Span(self,name,args))
+
+    def record(self,name,start,end,args={}):
+        """Add a timed event to the profile"""
+        self.lock.acquire()
+        try:
+            phase = self.phases.setdefault(name,{'count':0,'seconds':0.})
+            phase['count'] += 1
+            phase['seconds'] += end-start
+            if self.trace:
+                event = {'name':name,'cat':name.split(':')[0],'ph':'X','pid':os.getpid(),
+                         'tid':threading.current_thread().ident,'ts':int((start-self.origin)*1e6),
+                         'dur':int((end-start)*1e6)}
+                if args: event['args'] = args
+                self.events.append(event)
+        finally:
+            self.lock.release()
+
+    def count(self,name):
+        """Count an untimed event (such as a cache hit)"""
+        if not self.enabled: return
+        self.record(name,0.,0.)
+
+    def write(self,directory):
+        """Save the summary (and trace) of the profile in a directory"""
+        if not self.enabled: return
+        outputs = [(self.summary_name,{'wall':time()-self.origin,'phases':self.phases})]
+        if self.trace: outputs.append((self.trace_name,{'traceEvents':self.events,'displayTimeUnit':'ms'}))
+        for (name,data) in outputs:
+            try:
+                fd = open(os.path.join(directory,name),'wb')
+                try:
+                    json.dump(data,fd,indent=1,sort_keys=True)
+                finally:
+                    fd.close()
+            except IOError:
+                print "Warning: unable to write profile "+name+" to "+directory
+
+profiler = Profiler()
+
+def profiled(name):
+    """Decorator that times each call of a function as a profile phase"""
+    def decorator(function):
+        def wrapper(*args,**kwargs):
+            if not profiler.enabled: return(function(*args,**kwargs))
+            with profiler.span(name):
+                return(function(*args,**kwargs))
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return(wrapper)
+    return(decorator)
+
+@profiled('mkdir')
 def mkdir_p(path):
     import os,sys,errno
     try:
         os.makedirs(path)
+        statCache.invalidate(path)
     except OSError:
         value = sys.exc_info()[1][0]
         if value == errno.EEXIST:
@@ -123,18 +259,76 @@ def mkdir_p(path):
                              +path+': '+str(sys.exc_info())+"\n")
             raise
 
+class PathIndex(dict):
+    """Listing of the contents of search path directories, read once per run"""
+
+    # Class variables
+    settle = 2.
+
+    max_entries = 1000
+
+    def __init__(self):
+        """Class constructor"""
+        self.disk = None
+        self.listings = {}
+
+    def _list(self,dir):
+        """Return the names in a directory (None if it cannot be listed)"""
+        try:
+            mtime = os.stat(dir).st_mtime
+        except OSError:
+            return(None)
+        # Listings kept from earlier runs of a resident process are valid while the mtime is unchanged
+        cached = self.listings.get(dir)
+        if cached and cached[0] == mtime: return(cached[1])
+        key = None
+        if self.disk:
+            key = hashlib.md5(os.path.abspath(dir)).hexdigest()
+            cached = self.disk.get(key)
+            if cached and cached[0] == mtime:
+                self.listings[dir] = cached
+                return(cached[1])
+        try:
+            names = frozenset(os.listdir(dir))
+        except OSError:
+            return(None)
+        # Listings of recently modified directories may miss entries added within the mtime resolution
+        if time() - mtime > self.settle:
+            if len(self.listings) >= self.max_entries: self.listings.clear()
+            self.listings[dir] = (mtime,names)
+            if key: self.disk.put(key,(mtime,names))
+        return(names)
+
+    def contents(self,dir):
+        """Return the names in a directory, listing it on first use"""
+        try:
+            return(self[dir])
+        except KeyError:
+            names = self[dir] = self._list(dir)
+            return(names)
+
+    def find(self,name,bin_path):
+        """Return the first executable file with the given name on the path"""
+        for dir in re.split(':',bin_path):
+            names = self.contents(dir)
+            if names is not None and name not in names: continue
+            fullname=os.path.join(dir,name)
+            try:
+                if os.path.isfile(fullname):
+                    if os.access(fullname,os.X_OK): return(fullname)
+            except:
+                continue
+        return('')
+
+pathIndex = PathIndex()
+
 def which(name,path=None,verbose=True):
     """Duplicates the functionality of UNIX 'which' command"""    
     if re.search('/',name):
         return(name)    
     bin_path = path and path or os.environ['PATH']
-    for dir in re.split(':',bin_path):
-        fullname=os.path.join(dir,name)
-        try:
-            if os.path.isfile(fullname):
-                if os.access(fullname,os.X_OK): return(fullname) 
-        except:
-            continue
+    fullname = pathIndex.find(name,bin_path)
+    if fullname: return(fullname)
     if (verbose): print "Warning: unable to find "+name+" in path:\n"+bin_path
     return('')  
 
@@ -145,8 +339,37 @@ def path2host(machine,path):
     else:
         return(path)
 
-def resolveKeywords(entry,delim_exec='',set=None,verbose=False,internals={}):
-    """Resolve special keywords in the entry (no procesing for keywords in embedded commands)"""
+def lookupKeyword(keyword,set=None,internals={}):
+    """Return the value of a keyword and its type ('internal', 'found' or the namespaces searched)"""
+    if internals.has_key(keyword):
+        return(internals[keyword],'internal')
+    if set:
+        # The set namespace takes precedence and is authoritative when available
+        if set.has_key(keyword):
+            return(set[keyword],'found')
+        return('',os.environ.has_key(keyword) and 'found/set' or 'environment/set')
+    if os.environ.has_key(keyword):
+        return(os.environ[keyword],'found')
+    return('','environment')
+
+def warnUndefined(keyword,vartype,verbose=False):
+    """Generate a warning message for an undefined keyword (once per keyword)"""
+    if not keyword in undef_list.saved:
+        warnline = "Warning: "+vartype+" variable "+keyword+" undefined ... empty substitution performed"
+        sys.stderr.write(warnline+'\n')
+        if (verbose): print warnline
+        undef_list(keyword)
+
+def warnDollar(element_orig,element,verbose=False):
+    """Generate an error message for leftover $ symbols"""
+    warnline="Error: found a $ character after resolution of "+element_orig+" to "+element+ \
+              "\n  The result of external keyword resolution cannot contain un-expanded shell variables.  Evaluate the\n"+\
+              "  string or remove extra quoting / escape characters before the task_setup call to avoid this problem.  "
+    sys.stderr.write(warnline+'\n')
+    if (verbose): print warnline
+
+def _resolveKeywordsRegex(entry,delim_exec='',set=None,verbose=False,internals={}):
+    """Resolve special keywords by repeated substitution (reference implementation)"""
     delim_start='\$\{'
     delim_end='}'
     delim = re.compile(delim_start+'(.*?)'+delim_end)
@@ -161,31 +384,12 @@ def resolveKeywords(entry,delim_exec='',set=None,verbose=False,internals={}):
         else:
             # This is a standard string.  Attempt to replace all keywords.
             for keyword in delim.findall(elements[i]):
-                vartype = 'unknown'
                 if not keyword: continue
-                if internals.has_key(keyword):
-                    this_keyword = internals[keyword]
+                (this_keyword,vartype) = lookupKeyword(keyword,set=set,internals=internals)
+                if vartype is 'internal':
                     found_internal = True
-                    vartype = 'internal'
-                if not vartype is 'internal':
-                    try:
-                        this_keyword = os.environ[keyword]
-                        vartype = 'found'
-                    except KeyError:
-                        vartype = 'environment'
-                    if set: 
-                        try:
-                            this_keyword = set[keyword]
-                            vartype='found'
-                        except KeyError:
-                            vartype = vartype+'/set'
-                    if vartype is not 'found':
-                        if not keyword in undef_list.saved:
-                            warnline = "Warning: "+vartype+" variable "+keyword+" undefined ... empty substitution performed"
-                            sys.stderr.write(warnline+'\n')
-                            if (verbose): print warnline
-                            undef_list(keyword)
-                        this_keyword = ''
+                elif vartype is not 'found':
+                    warnUndefined(keyword,vartype,verbose=verbose)
                 elements[i] = re.sub(delim_start+keyword+delim_end,this_keyword,elements[i])
             # Final substitution attempt to support deep internal indexing
             for keyword in delim.findall(elements[i]):
@@ -197,149 +401,1247 @@ def resolveKeywords(entry,delim_exec='',set=None,verbose=False,internals={}):
                 elements[i] = re.sub(delim_start+keyword+delim_end,this_keyword,elements[i])
             # Check for leftover $ symbols and generate error message
             if dollar.search(elements[i]):    
-                warnline="Error: found a $ character after resolution of "+element_orig+" to "+elements[i]+ \
-                          "\n  The result of external keyword resolution cannot contain un-expanded shell variables.  Evaluate the\n"+\
-                          "  string or remove extra quoting / escape characters before the task_setup call to avoid this problem.  "
-                sys.stderr.write(warnline+'\n')
-                if (verbose): print warnline
+                warnDollar(element_orig,elements[i],verbose=verbose)
     updated = ''.join(elements)
     return({'string':updated,'contains_internal':found_internal})
 
-def getTruePath(node,verbosity):
-    """Get the true path of a file/directory"""
-    if node == "": return ""  
-    have_subprocess=True
-    if (int(verbosity) >= 2): startTime=time()
+class KeywordTemplate(object):
+    """Pre-parsed entry that resolves its keywords in a single pass"""
+
+    # Class variables
+    delim = re.compile('\$\{(.*?)}')
+    simple_keyword = re.compile('\w+$')
+
+    def __init__(self,entry,delim_exec=''):
+        """Class constructor"""
+        self.entry = entry
+        self.delim_exec = delim_exec
+        self.simple = True
+        self.elements = []
+        elements = delim_exec and re.split(delim_exec+'(.*?)'+delim_exec,entry) or [entry]
+        for i in range(0,len(elements)):
+            if i%2:
+                # Embedded commands are kept verbatim with their delimiters
+                self.elements.append((None,[delim_exec+elements[i]+delim_exec]))
+                continue
+            # Standard strings alternate literal text and keywords
+            parts = ['']
+            pos = 0
+            for match in self.delim.finditer(elements[i]):
+                parts[-1] += elements[i][pos:match.start()]
+                if match.group(1):
+                    if not self.simple_keyword.match(match.group(1)): self.simple = False
+                    parts.extend([match.group(1),''])
+                else:
+                    parts[-1] += match.group(0)
+                pos = match.end()
+            parts[-1] += elements[i][pos:]
+            self.elements.append((elements[i],parts))
+        self.keywords = [part for (orig,parts) in self.elements if orig is not None for part in parts[1::2]]
+
+    def render(self,set=None,verbose=False,internals={}):
+        """Resolve keywords against the internals, set namespace and environment"""
+        if not self.simple:
+            return(_resolveKeywordsRegex(self.entry,delim_exec=self.delim_exec,set=set,verbose=verbose,internals=internals))
+        # Resolve all keywords first so that a fallback cannot repeat any messages
+        found_internal = False
+        resolved = []
+        for (element_orig,parts) in self.elements:
+            pieces = [parts[0]]
+            undefined = []
+            for j in range(1,len(parts),2):
+                (this_keyword,vartype) = lookupKeyword(parts[j],set=set,internals=internals)
+                if vartype is 'internal':
+                    found_internal = True
+                elif vartype is not 'found':
+                    undefined.append((parts[j],vartype))
+                if '\\' in this_keyword:
+                    # Substituted values are regex templates in the reference implementation
+                    return(_resolveKeywordsRegex(self.entry,delim_exec=self.delim_exec,set=set,verbose=verbose,internals=internals))
+                pieces.extend([this_keyword,parts[j+1]])
+            element = ''.join(pieces)
+            if element_orig is not None and '$' in element and \
+                    [True for match in self.delim.finditer(element) if match.group(1)]:
+                # Keywords generated by substitution require the repeated passes of the reference implementation
+                return(_resolveKeywordsRegex(self.entry,delim_exec=self.delim_exec,set=set,verbose=verbose,internals=internals))
+            resolved.append((element_orig,element,undefined))
+        # Generate messages in the order of the reference implementation
+        for (element_orig,element,undefined) in resolved:
+            for (keyword,vartype) in undefined:
+                warnUndefined(keyword,vartype,verbose=verbose)
+            if element_orig is not None and '$' in element:
+                warnDollar(element_orig,element,verbose=verbose)
+        return({'string':''.join([element for (element_orig,element,undefined) in resolved]),
+                'contains_internal':found_internal})
+
+keywordTemplates = {}
+
+@profiled('keywords')
+def resolveKeywords(entry,delim_exec='',set=None,verbose=False,internals={}):
+    """Resolve special keywords in the entry (no procesing for keywords in embedded commands)"""
     try:
+        template = keywordTemplates[(entry,delim_exec)]
+    except KeyError:
+        template = KeywordTemplate(entry,delim_exec)
+        if len(keywordTemplates) >= ResultCache.max_entries: keywordTemplates.clear()
+        keywordTemplates[(entry,delim_exec)] = template
+    return(template.render(set=set,verbose=verbose,internals=internals))
+
+def shellQuote(string):
+    """Quote a string for safe use as a single shell word"""
+    return("'"+string.replace("'","'\\''")+"'")
+
+class Job(object):
+    """Pending result of a call submitted to the executor"""
+
+    def __init__(self):
+        """Class constructor"""
+        self.done = threading.Event()
+        self.value = None
+        self.exc_info = None
+
+    def _call(self,function,args):
+        """Perform the call and record its outcome"""
+        try:
+            self.value = function(*args)
+        except:
+            self.exc_info = sys.exc_info()
+
+    def result(self):
+        """Wait for the call to complete and return its value (re-raising its exception)"""
+        self.done.wait()
+        if self.exc_info: raise self.exc_info[0],self.exc_info[1],self.exc_info[2]
+        return(self.value)
+
+class Executor(object):
+    """Shared execution layer for external commands and remote requests"""
+
+    # Class variables
+    max_total = int(os.environ.get('TASK_SETUP_MAX_PROCS','16'))      #Calls in progress at once
+    max_per_host = int(os.environ.get('TASK_SETUP_MAX_PER_HOST','4')) #Calls in progress at once for each host
+
+    def __init__(self):
+        """Class constructor"""
+        self.total = threading.BoundedSemaphore(self.max_total)
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _limit(self,host):
+        """Return the semaphore bounding the calls to a host"""
+        self.lock.acquire()
+        try:
+            if not self.hosts.has_key(host):
+                self.hosts[host] = threading.BoundedSemaphore(self.max_per_host)
+            return(self.hosts[host])
+        finally:
+            self.lock.release()
+
+    def _run(self,job,host,function,args):
+        """Perform a call within the per-host and global limits"""
+        self.local.worker = True
+        limit = self._limit(host)
+        limit.acquire()
+        self.total.acquire()
+        try:
+            job._call(function,args)
+        finally:
+            self.total.release()
+            limit.release()
+            job.done.set()
+
+    def submit(self,host,function,*args):
+        """Start a call on behalf of a host (None for local work) and return its pending Job"""
+        job = Job()
+        if getattr(self.local,'worker',False):
+            # Calls made from a running job are performed in place so that waiting on them cannot exhaust the limits
+            job._call(function,args)
+            job.done.set()
+            return(job)
+        thread = threading.Thread(target=self._run,args=(job,host,function,args))
+        thread.setDaemon(True)
+        thread.start()
+        return(job)
+
+    def command(self,command,host=None):
+        """Start a shell command and return a Job for its (status,stdout,stderr)"""
+        return(self.submit(host,self._command,command))
+
+    def _command(self,command):
+        """Execute a shell command, draining its STDOUT and STDERR concurrently"""
         import subprocess
-    except ImportError:
-        have_subprocess=False            
-    try:
-        get_true_path = "true_path "+node
-        if have_subprocess:
-            p = subprocess.Popen(get_true_path,shell=True,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
-            true_src = p.stdout.read()                
+        with profiler.span('exec'):
+            p = subprocess.Popen(command,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE,close_fds=True)
+            (output,error) = p.communicate()
+        return(p.returncode,output,error)
+
+    def remote(self,host,op,args):
+        """Start a request on the remote channel of a host and return a Job for its (result,error) reply"""
+        return(self.submit(host,self._remote,host,op,args))
+
+    def _remote(self,host,op,args):
+        """Perform a request on the remote channel of a host"""
+        return(remoteSessions.session(host).request(op,args))
+
+executor = Executor()
+
+class StatCache(dict):
+    """Per-run status and directory listings of local source files, shared by LinkFile and Config"""
+
+    # Class variables
+    scan_threshold = 4   #Sources in a directory from which it is listed to rule out missing sources without a stat
+
+    def __init__(self):
+        """Class constructor"""
+        self.links = set()
+        self.parents = {}
+        self.listings = {}
+
+    def reset(self):
+        """Forget the status of the files seen so far"""
+        self.clear()
+        self.links.clear()
+        self.parents.clear()
+        self.listings.clear()
+
+    def invalidate(self,path):
+        """Drop the status of a path created or moved by the setup and the listings of the directories above it"""
+        self.pop(path,None)
+        # The path itself is not resolved: a new link leads to its target, whose listing is unchanged
+        path = os.path.join(os.path.realpath(os.path.dirname(path) or os.curdir),os.path.basename(path))
+        self.pop(path,None)
+        while True:
+            parent = os.path.dirname(path)
+            self.listings.pop(parent,None)
+            if parent == path: break
+            path = parent
+
+    def stat(self,path):
+        """Return the status of a path, raising OSError if it does not exist"""
+        try:
+            return(self[path])
+        except KeyError:
+            pass
+        result = os.lstat(path)
+        if S_ISLNK(result.st_mode):
+            self.links.add(path)
+            result = os.stat(path)
+        # Missing paths are not cached because they may be created later in the run (e.g. output targets)
+        self[path] = result
+        return(result)
+
+    def realpath(self,path):
+        """Return the canonical form of an existing path, resolving each parent directory once"""
+        (parent,name) = os.path.split(path)
+        # Only normalized absolute paths can share a resolved parent ('..' must be applied after following links)
+        if not name or not self.has_key(path) or path in self.links or not os.path.isabs(path) or \
+                os.path.normpath(path) != path:
+            return(os.path.realpath(path))
+        real_parent = self.parents.get(parent)
+        if real_parent is None: real_parent = self.parents[parent] = os.path.realpath(parent)
+        return(os.path.join(real_parent,name))
+
+    def _scan(self,directory,cached=False):
+        """Return the names in a directory in listing order and as a set, listing it once per run (None if it cannot be listed)"""
+        # Listings are kept under the directory that os.listdir() actually reads
+        real = os.path.realpath(directory and directory or os.curdir)
+        try:
+            return(self.listings[real])
+        except KeyError:
+            if cached: return(None)
+        try:
+            names = os.listdir(real)
+        except OSError:
+            # Unreadable directories are not cached because they may be created later in the run
+            return(None)
+        listing = self.listings[real] = (names,frozenset(names))
+        return(listing)
+
+    def _match(self,directory,pattern):
+        """Return the names in a directory that match a wildcard pattern (as glob.glob1)"""
+        import fnmatch
+        listing = self._scan(directory)
+        if listing is None: return([])
+        names = listing[0]
+        if pattern[0] != '.': names = [name for name in names if name[0] != '.']
+        return(fnmatch.filter(names,pattern))
+
+    def expand(self,pattern):
+        """Expand a local wildcard pattern as glob.glob, matching against the cached directory listings"""
+        from glob import has_magic
+        (dirname,basename) = os.path.split(pattern)
+        if not has_magic(pattern):
+            if basename:
+                return(os.path.lexists(pattern) and [pattern] or [])
+            return(os.path.isdir(dirname) and [pattern] or [])
+        if not dirname:
+            return(self._match(os.curdir,basename))
+        if dirname != pattern and has_magic(dirname):
+            dirs = self.expand(dirname)
         else:
-            (stdin,stdout_stderr) = os.popen4(get_true_path,'r')
-            true_src = stdout_stderr.read()
-            stdin.close()
-            stdout_stderr.close()
-        if true_src == '(null)' or not true_src or re.search('No such file or directory$',true_src,re.M) or \
-                re.search('Probleme avec le path',true_src):
-            true_src = node
-    except OSError:
-        if (os.path.exists(node)):
-            print "Warning: true_path does not exist or returned an error for "+src_file
-        true_src = node
+            dirs = [dirname]
+        paths = []
+        for directory in dirs:
+            if has_magic(basename):
+                paths.extend([os.path.join(directory,name) for name in self._match(directory,basename)])
+            elif (basename and os.path.lexists(os.path.join(directory,basename))) or (not basename and os.path.isdir(directory)):
+                paths.append(os.path.join(directory,basename))
+        return(paths)
+
+    def kinds(self,paths):
+        """Return the kind of each path ('directory', 'file' or None if it does not exist)"""
+        groups = {}
+        for path in paths:
+            if path and not self.has_key(path): groups.setdefault(os.path.dirname(path),set()).add(path)
+        listings = {}
+        for (directory,members) in groups.items():
+            if len(members) >= self.scan_threshold:
+                listings[directory] = self._scan(directory)
+            else:
+                listings[directory] = self._scan(directory,cached=True)
+        kinds = []
+        for path in paths:
+            kind = None
+            listing = listings.get(os.path.dirname(path))
+            name = os.path.basename(path)
+            if path and (listing is None or name in (os.curdir,os.pardir) or name in listing[1]):
+                try:
+                    kind = S_ISDIR(self.stat(path).st_mode) and 'directory' or 'file'
+                except OSError:
+                    pass
+            kinds.append(kind)
+        return(kinds)
+
+statCache = StatCache()
+
+class TruePathResolver(object):
+    """Memoized, in-process equivalent of the 'true_path' utility"""
+
+    # Class variables
+    external_only = os.environ.has_key('TASK_SETUP_EXTERNAL_TRUEPATH') #Always defer to 'true_path' if set
+    separator = 'TASK_SETUP_TRUEPATH_SEPARATOR'
+    chunk_size = 64                                                      #Nodes resolved by each call to 'true_path'
+
+    def __init__(self):
+        """Class constructor"""
+        self.cache = {}
+
+    def reset(self):
+        """Forget the paths resolved so far and re-read the environment"""
+        self.cache.clear()
+        self.external_only = os.environ.has_key('TASK_SETUP_EXTERNAL_TRUEPATH')
+
+    def _resolveLocal(self,node):
+        """Resolve a path in-process, returning None if 'true_path' must be consulted"""
+        if self.external_only: return(None)
+        try:
+            statCache.stat(node)
+        except OSError:
+            if sys.exc_info()[1].errno in (errno.ENOENT,errno.ENOTDIR):
+                # Missing nodes are returned as-is (as when true_path fails) but not cached
+                # because they may be created later in the run (e.g. output targets)
+                return(False)
+            return(None)
+        return(statCache.realpath(node))
+
+    def _resolveExternal(self,nodes):
+        """Resolve a list of paths with concurrent calls to 'true_path', one for each chunk of nodes"""
+        chunks = [nodes[i:i+self.chunk_size] for i in range(0,len(nodes),self.chunk_size)]
+        jobs = [executor.command("for node in "+' '.join([shellQuote(node) for node in chunk])+" ; do printf '\\n%s\\n' "+ \
+                                     self.separator+" ; true_path \"${node}\" 2>&1 ; done 2>&1") for chunk in chunks]
+        true_paths = []
+        for (chunk,job) in zip(chunks,jobs):
+            try:
+                (status,output,error) = job.result()
+            except OSError:
+                print "Warning: true_path does not exist or returned an error for "+' '.join(chunk)
+                true_paths.extend(chunk)
+                continue
+            true_paths.extend(self._parseExternal(chunk,output))
+        return(true_paths)
+
+    def _parseExternal(self,nodes,output):
+        """Extract the true paths of a list of nodes from the output of 'true_path'"""
+        results = output.split('\n'+self.separator+'\n')[1:]
+        true_paths = []
+        for i in range(0,len(nodes)):
+            try:
+                true_src = results[i].rstrip('\n')
+            except IndexError:
+                true_src = ''
+            if true_src == '(null)' or not true_src or re.search('No such file or directory$',true_src,re.M) or \
+                    re.search('Probleme avec le path',true_src):
+                true_src = nodes[i]
+            true_paths.append(true_src)
+        return(true_paths)
+
+    @profiled('truepath')
+    def resolve(self,nodes):
+        """Return the true paths for a list of nodes"""
+        unresolved = []
+        for node in nodes:
+            if not node or self.cache.has_key(node): continue
+            true_src = self._resolveLocal(node)
+            if true_src is None:
+                if not node in unresolved: unresolved.append(node)
+            elif true_src:
+                self.cache[node] = true_src
+        if unresolved:
+            for (node,true_src) in zip(unresolved,self._resolveExternal(unresolved)):
+                self.cache[node] = true_src
+        return([self.cache.get(node,node) for node in nodes])
+
+truePathResolver = TruePathResolver()
+
+def getTruePath(node,verbosity):
+    """Get the true path of a file/directory"""
+    if node == "": return ""
+    if (int(verbosity) >= 2): startTime=time()
+    true_src = truePathResolver.resolve([node])[0]
     if (int(verbosity) >= 2): print("Info 2: getTruePath exec time: " + str( time() - startTime))
     return(true_src)
 
+class RemoteSession(object):
+    """Long-lived channel to a helper process on a remote host"""
+
+    # Class variables
+    rsh = os.environ.get('TASK_SETUP_RSH','ssh')   #Remote shell command (replace with a local stand-in for testing)
+    python = 'python'                               #Python interpreter on the remote host
+    ready = 'TASK_SETUP_HELPER_READY'
+    bootstrap = "bash --login -c \"%s -c 'import sys;n=int(sys.stdin.readline());exec(sys.stdin.read(n))'\""
+    helper = r'''
+import glob,os,sys,subprocess,json
+def remote_glob(patterns):
+    return([glob.glob(pattern) for pattern in patterns],'')
+def remote_ftype(paths):
+    return([os.path.isdir(path) and 2 or (os.path.isfile(path) and 1 or 0) for path in paths],'')
+def remote_mkdir(dirs):
+    status = []; errors = ''
+    for directory in dirs:
+        if not os.path.isdir(directory):
+            p = subprocess.Popen('s.mkdir_onebyone '+directory,shell=True,stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,universal_newlines=True)
+            errors += p.communicate()[1]
+        status.append(os.path.isdir(directory))
+    return(status,errors)
+ops = {'glob':remote_glob,'ftype':remote_ftype,'mkdir':remote_mkdir}
+sys.stdout.write('TASK_SETUP_HELPER_READY\n')
+sys.stdout.flush()
+while True:
+    line = sys.stdin.readline()
+    if not line: break
+    try:
+        request = json.loads(line)
+        (result,error) = ops[request['op']](request['args'])
+    except Exception:
+        (result,error) = (None,'helper error: '+str(sys.exc_info()[1]))
+    sys.stdout.write(json.dumps({'result':result,'error':error})+'\n')
+    sys.stdout.flush()
+'''
+
+    def __init__(self,host):
+        """Class constructor"""
+        self.host = host
+        self.proc = None
+        self.failed = False
+        self.failure = ''
+        self.stderr = []
+        self.lock = threading.Lock()
+
+    def _readStderr(self):
+        """Collect the STDERR of the remote channel"""
+        for line in iter(self.proc.stderr.readline,''):
+            self.stderr.append(line)
+
+    def _drainStderr(self):
+        """Return and clear the STDERR collected so far"""
+        error = ''.join(self.stderr)
+        del self.stderr[:len(self.stderr)]
+        return(error)
+
+    def _start(self):
+        """Launch the remote helper and wait for its ready signal"""
+        import subprocess
+        try:
+            self.proc = subprocess.Popen([self.rsh,self.host,self.bootstrap % self.python],
+                                         stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        except OSError:
+            self.stderr.append("unable to execute "+self.rsh+": "+str(sys.exc_info()[1])+'\n')
+            self.failed = True
+            return
+        self.reader = threading.Thread(target=self._readStderr)
+        self.reader.setDaemon(True)
+        self.reader.start()
+        try:
+            self.proc.stdin.write(str(len(self.helper))+'\n'+self.helper)
+            self.proc.stdin.flush()
+        except IOError:
+            pass
+        for line in iter(self.proc.stdout.readline,''):
+            if line.rstrip('\n') == self.ready: return
+        self._stop()
+
+    def _stop(self):
+        """Shut down a failed or finished channel"""
+        self.failed = True
+        try:
+            self.proc.stdin.close()
+        except IOError:
+            pass
+        self.proc.wait()
+        self.reader.join(5)
+
+    def _decode(self,value):
+        """Convert unicode strings in a helper reply back to plain strings"""
+        if isinstance(value,list):
+            return([self._decode(item) for item in value])
+        if isinstance(value,unicode):
+            return(value.encode('utf-8'))
+        return(value)
+
+    def request(self,op,args):
+        """Send a request to the remote helper and return its (result,error) reply"""
+        with profiler.span('remote:'+self.host+':'+op,count=len(args)):
+            return(self._request(op,args))
+
+    def _request(self,op,args):
+        """Perform a request on the remote channel"""
+        self.lock.acquire()
+        try:
+            if not self.proc and not self.failed: self._start()
+            if self.failed:
+                # Every caller of a failed channel is given the STDERR that explains the failure
+                self.failure += self._drainStderr()
+                return(None,self.failure)
+            try:
+                self.proc.stdin.write(json.dumps({'op':op,'args':args})+'\n')
+                self.proc.stdin.flush()
+                reply = self.proc.stdout.readline()
+            except IOError:
+                reply = ''
+            if not reply:
+                self._stop()
+                self.failure += self._drainStderr()
+                return(None,self.failure)
+            reply = json.loads(reply)
+            return(self._decode(reply['result']),self._drainStderr()+self._decode(reply['error']))
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Close the remote channel"""
+        if self.proc and not self.failed: self._stop()
+
+class RemoteSessions(dict):
+    """Registry of remote channels, one per host for the duration of the run"""
+
+    lock = threading.Lock()
+
+    def session(self,host):
+        """Return the channel for a host, creating it if necessary"""
+        self.lock.acquire()
+        try:
+            if not self.has_key(host):
+                self[host] = RemoteSession(host)
+            return(self[host])
+        finally:
+            self.lock.release()
+
+    def prune(self):
+        """Drop the channels that failed or were opened with another remote shell"""
+        rsh = os.environ.get('TASK_SETUP_RSH','ssh')
+        for (host,session) in self.items():
+            if session.failed or session.rsh != rsh:
+                session.close()
+                del self[host]
+        RemoteSession.rsh = rsh
+
+    def close(self):
+        """Close all remote channels"""
+        for session in self.values():
+            session.close()
+        self.clear()
+
+remoteSessions = RemoteSessions()
+atexit.register(remoteSessions.close)
+
+class OrderedOutput(object):
+    """Capture the output of worker threads for replay in a deterministic order"""
+
+    class Router(object):
+        """Stream proxy that diverts writes from capturing threads"""
+        def __init__(self,stream,local):
+            """Class constructor"""
+            self.stream = stream
+            self.local = local
+            self.spaces = threading.local()
+        def _getSoftspace(self):
+            """Return the print softspace flag of the current thread"""
+            return(getattr(self.spaces,'softspace',0))
+        def _setSoftspace(self,value):
+            """Set the print softspace flag of the current thread"""
+            self.spaces.softspace = value
+        softspace = property(_getSoftspace,_setSoftspace)
+        def write(self,text):
+            """Write to the thread's capture buffer if active or to the stream otherwise"""
+            chunks = getattr(self.local,'chunks',None)
+            if chunks is None:
+                self.stream.write(text)
+            else:
+                chunks.append((self.stream,text))
+        def __getattr__(self,name):
+            """Delegate all other attributes to the wrapped stream"""
+            return(getattr(self.stream,name))
+
+    def __init__(self):
+        """Class constructor"""
+        self.local = threading.local()
+        self.saved = None
+
+    def install(self):
+        """Route the standard streams through the capture buffers"""
+        self.saved = (sys.stdout,sys.stderr)
+        sys.stdout = self.Router(sys.stdout,self.local)
+        sys.stderr = self.Router(sys.stderr,self.local)
+
+    def uninstall(self):
+        """Restore the standard streams"""
+        (sys.stdout,sys.stderr) = self.saved
+
+    def capture(self):
+        """Start capturing output for the current thread"""
+        self.local.chunks = []
+
+    def release(self):
+        """Stop capturing output for the current thread and return the captured chunks"""
+        chunks = self.local.chunks
+        self.local.chunks = None
+        return(chunks)
+
+    def emit(self,chunks):
+        """Write captured chunks to their original streams"""
+        for (stream,text) in chunks:
+            stream.write(text)
+
 class LinkFile():
     """Structure for link file target information"""
 
-    def __init__(self,link,target_host,target,link_only,verbosity=False):
+    def __init__(self,link,target_host,target,link_only,verbosity=False,expansion=None):
         """Class constructor"""
-        self.have_subprocess=True
-        try:
-            import subprocess
-        except ImportError:
-            self.have_subprocess=False      
         self.link = link
         self.target_host = target_host
         self.target = target
         self.link_only = link_only
         self.verbosity = verbosity
+        self.expansion = expansion and expansion or {}
         self.src = []
         self.host = []
         self._expandTarget()
         self._trueSources()
         self._setPrefixes()
         self._sourceTypes()
+        self._localTypes()
 
     def _expandTarget(self):
         """Complete target information through local or remote wildcard expansion"""
-        import glob      
+        expansions = []
         for i in range(0,len(self.target)):
             src_expanded = []
             try:
                 hostname = self.target_host[i]
             except TypeError:
                 hostname = None
-            src_expanded = glob.glob(self.target[i])            
-            if len(src_expanded) < 1 and hostname:
-                file_sep = '?'
-                file_list = "ssh "+hostname+" \"python -c 'import glob; f=glob.glob(\\\""+self.target[i]+"\\\"); print(\\\""+file_sep+"\\\".join(f))'\""
-                if self.have_subprocess:
-                    import subprocess
-                    p = subprocess.Popen(file_list,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-                    output = p.stdout.read()
-                    error = p.stderr.read()
-                else:
-                    (stdin,stdout,stderr) = os.popen3(file_list,'r')
-                    output = stdout.read()
-                    error = stderr.read()                            
-                src_expanded = [fname.rstrip('\n') for fname in re.split('\\'+file_sep,output.rstrip('\n')) if fname]
+            if self.expansion.has_key((hostname,self.target[i])):
+                src_expanded = self.expansion[(hostname,self.target[i])]
+            else:
+                src_expanded = statCache.expand(self.target[i])
+                if len(src_expanded) < 1 and hostname:
+                    src_expanded = executor.remote(hostname,'glob',[self.target[i]])
+            expansions.append((hostname,self.target[i],src_expanded))
+        for (hostname,target,src_expanded) in expansions:
+            if isinstance(src_expanded,Job):
+                (output,error) = src_expanded.result()
+                src_expanded = output and output[0] or []
             if len(src_expanded) < 1:
-                src_expanded = [self.target[i]]                      
+                src_expanded = [target]                      
             self.src.extend(src_expanded)
             self.host.extend([hostname for item in src_expanded])
 
-    def _trueSources(self):
-        """Get true source paths for entries"""
-        self.true_src_file = [getTruePath(src_file,self.verbosity) for src_file in self.src]
+    def _trueSources(self):
+        """Get true source paths for entries"""
+        if (int(self.verbosity) >= 2): startTime=time()
+        self.true_src_file = truePathResolver.resolve(self.src)
+        if (int(self.verbosity) >= 2): print("Info 2: getTruePath exec time: " + str( time() - startTime))
+
+    def _setPrefixes(self):
+        """Set hosts and prefixes for entries"""
+        self.src_file_prefix = [target_host and intern(target_host+':') or '' for target_host in self.host]
+
+    def _sourceTypes(self):
+        """Determine the type of source"""
+        self.remote_file_type = ['' for src in self.true_src_file]
+        requests = []
+        for host in set(self.host):
+            if not host: continue
+            idx = []
+            for i in range(0,len(self.true_src_file)):                
+                if self.host[i] == host:
+                    idx.append(i)
+            requests.append((host,idx,executor.remote(host,'ftype',[self.true_src_file[i] for i in idx])))
+        for (host,idx,job) in requests:
+            (output,error) = job.result()
+            if len(error) > 0:
+                warnline = "Warning: STDERR returned from "+host+" is "+error
+                sys.stderr.write(warnline+'\n')
+                if (self.verbosity): print warnline
+            if output is not None:
+                for i in range(0,len(idx)):
+                    try:
+                        ftype = int(output[i])
+                    except (IndexError,TypeError,ValueError):
+                        if not self.link_only:
+                            print "Warning: required file "+self.true_src_file[idx[i]]+" does not exist on host "+host
+                        continue
+                    if ftype == 1:
+                        self.remote_file_type[idx[i]] = 'file'
+                    elif ftype == 2:
+                        self.remote_file_type[idx[i]] = 'directory'
+            else:
+                print "Warning: unable to login to target host "+host+". See previous error statement for STDERR details."
+
+    def _localTypes(self):
+        """Determine the type of the sources on the local filesystem"""
+        self.local_file_type = statCache.kinds(self.true_src_file)
+
+    def rephost(self):
+        """Repeat host entry for all targets"""
+        self.src.extend(self.target)
+        self.host.extend([self.target_host[0] for item in self.target])
+
+class FileCopier(object):
+    """Copy files using the cheapest method supported by the filesystem"""
+
+    # Class variables
+    methods = ['hardlink','reflink','range','stream']
+    ficlone = 0x40049409
+    chunk = 1024*1024*1024
+    buffer = 1024*1024
+
+    def __init__(self):
+        """Class constructor"""
+        self.libc = None
+        self.unsupported = set()
+
+    def _libc(self):
+        """Load the C library functions used for in-kernel copies"""
+        if self.libc is None:
+            import ctypes
+            try:
+                self.libc = ctypes.CDLL(None,use_errno=True)
+            except OSError:
+                self.libc = False
+                return(self.libc)
+            for (name,argtypes) in (('copy_file_range',[ctypes.c_int,ctypes.c_void_p,ctypes.c_int,ctypes.c_void_p,ctypes.c_size_t,ctypes.c_uint]),
+                                    ('sendfile',[ctypes.c_int,ctypes.c_int,ctypes.c_void_p,ctypes.c_size_t])):
+                try:
+                    function = getattr(self.libc,name)
+                except AttributeError:
+                    self.unsupported.add(name)
+                    continue
+                function.argtypes = argtypes
+                function.restype = ctypes.c_ssize_t
+        return(self.libc)
+
+    def _reflink(self,src_fd,dest_fd,size):
+        """Share the data blocks of the source (copy-on-write clone)"""
+        import fcntl
+        fcntl.ioctl(dest_fd,self.ficlone,src_fd)
+
+    def _range(self,src_fd,dest_fd,size):
+        """Copy the data within the kernel with copy_file_range or sendfile"""
+        import ctypes
+        libc = self._libc()
+        if not libc: raise OSError(errno.ENOSYS,'no C library')
+        if not size: raise OSError(errno.EOPNOTSUPP,'no size to copy')
+        for name in ('copy_file_range','sendfile'):
+            if name in self.unsupported: continue
+            copied = 0
+            while copied < size:
+                count = min(size-copied,self.chunk)
+                if name == 'copy_file_range':
+                    done = libc.copy_file_range(src_fd,None,dest_fd,None,count,0)
+                else:
+                    done = libc.sendfile(dest_fd,src_fd,None,count)
+                if done < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR: continue
+                    break
+                if done == 0:
+                    error = errno.EOPNOTSUPP
+                    break
+                copied += done
+            else:
+                return
+            if error in (errno.ENOSYS,errno.EOPNOTSUPP,errno.EXDEV,errno.EINVAL,errno.ENOTSUP):
+                if error == errno.ENOSYS: self.unsupported.add(name)
+                os.lseek(src_fd,0,0)
+                os.lseek(dest_fd,0,0)
+                os.ftruncate(dest_fd,0)
+                continue
+            raise OSError(error,os.strerror(error))
+        raise OSError(errno.EOPNOTSUPP,'no in-kernel copy available')
+
+    def _stream(self,src_fd,dest_fd,size):
+        """Copy the data through user space buffers"""
+        while True:
+            data = os.read(src_fd,self.buffer)
+            if not data: break
+            while data:
+                data = data[os.write(dest_fd,data):]
+
+    def copy(self,src,dest,method=None):
+        """Copy a file to its destination, returning the name of the method used"""
+        if method not in self.methods: method = 'reflink'
+        methods = self.methods[self.methods.index(method):]
+        if methods[0] == 'hardlink':
+            methods.pop(0)
+            if os.path.lexists(dest): os.remove(dest)
+            try:
+                os.link(src,dest)
+                return('hardlink')
+            except OSError:
+                pass
+        src_fd = os.open(src,os.O_RDONLY)
+        try:
+            src_stat = os.fstat(src_fd)
+            size = src_stat.st_size
+            try:
+                if os.path.samestat(src_stat,os.stat(dest)):
+                    if os.path.realpath(src) == os.path.realpath(dest):
+                        raise OSError(errno.EINVAL,src+' and '+dest+' are the same file')
+                    os.remove(dest)
+            except OSError:
+                if sys.exc_info()[1].errno != errno.ENOENT: raise
+            dest_fd = os.open(dest,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0666)
+            try:
+                for method in methods:
+                    if method in self.unsupported: continue
+                    try:
+                        getattr(self,'_'+method)(src_fd,dest_fd,size)
+                        return(method)
+                    except (IOError,OSError):
+                        if method == 'stream': raise
+                        if sys.exc_info()[1].errno in (errno.ENOTTY,errno.ENOSYS): self.unsupported.add(method)
+                        os.lseek(src_fd,0,0)
+                        os.lseek(dest_fd,0,0)
+                        os.ftruncate(dest_fd,0)
+            finally:
+                os.close(dest_fd)
+        finally:
+            os.close(src_fd)
+
+fileCopier = FileCopier()
+
+class DiskCache(object):
+    """Size-bounded directory of pickled values shared between runs"""
+
+    def __init__(self,directory,prefix,max_entries=10000):
+        """Class constructor"""
+        self.directory = directory
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.count = None
+
+    def _path(self,key):
+        """Return the file name used to store a key"""
+        return(os.path.join(self.directory,self.prefix+'-'+key))
+
+    def _entries(self):
+        """Return the paths of all entries stored under this prefix"""
+        try:
+            return([os.path.join(self.directory,name) for name in os.listdir(self.directory)
+                    if name.startswith(self.prefix+'-')])
+        except OSError:
+            return([])
+
+    def _evict(self):
+        """Remove the least recently used entries once the size bound is exceeded"""
+        if self.count is None: self.count = len(self._entries())
+        self.count += 1
+        if self.count <= self.max_entries: return
+        entries = []
+        for path in self._entries():
+            try:
+                entries.append((os.path.getmtime(path),path))
+            except OSError:
+                continue
+        entries.sort()
+        # Evict below the bound so that the directory is not listed on every insertion
+        excess = len(entries) - int(0.9*self.max_entries)
+        for (mtime,path) in entries[:max(excess,0)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.count = len(entries) - max(excess,0)
+
+    def get(self,key):
+        """Return the value stored for a key, or None if there is none"""
+        path = self._path(key)
+        try:
+            fd = open(path,'rb')
+            try:
+                value = cPickle.load(fd)
+            finally:
+                fd.close()
+            os.utime(path,None)
+        except (IOError,OSError,EOFError,ValueError,cPickle.UnpicklingError):
+            return(None)
+        return(value)
+
+    def put(self,key,value):
+        """Store a value for a key (atomically, so that concurrent runs can share the cache)"""
+        try:
+            mkdir_p(self.directory)
+            (fdunit,tmpname) = tempfile.mkstemp(dir=self.directory,prefix='.tmp-'+self.prefix)
+            fd = os.fdopen(fdunit,'wb')
+            try:
+                cPickle.dump(value,fd,2)
+            finally:
+                fd.close()
+            os.rename(tmpname,self._path(key))
+        except (IOError,OSError):
+            return
+        self._evict()
+
+class ResultCache(collections.OrderedDict):
+    """Bounded, least-recently-used cache of results with an optional on-disk layer"""
+
+    # Class variables
+    max_entries = 10000
+
+    def __init__(self):
+        """Class constructor"""
+        collections.OrderedDict.__init__(self)
+        self.disk = None
+
+    def key(self,*parts):
+        """Generate a cache key from its components"""
+        return(hashlib.md5(repr(parts)).hexdigest())
+
+    def lookup(self,key):
+        """Return a cached result, or None if there is none"""
+        try:
+            result = self.pop(key)
+        except KeyError:
+            if not self.disk: return(None)
+            result = self.disk.get(key)
+            if result is None: return(None)
+        self[key] = result
+        return(result)
+
+    def store(self,key,result):
+        """Save a result in all layers"""
+        self.pop(key,None)
+        self[key] = result
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+        if self.disk: self.disk.put(key,result)
+
+embeddedCache = ResultCache()
+namespaceCache = ResultCache()
+configCache = ResultCache()
+varcacheCache = ResultCache()
+
+class EmbeddedShell(object):
+    """Persistent shell co-process for the evaluation of embedded commands"""
+
+    # Class variables
+    shell = '/bin/sh'
+    varcache_shell = 'ksh93'                     #Shell used to generate variable caches (if available)
+    marker = 'TASK_SETUP_EMBEDDED_DONE'
+    varcache_marker = 'TASK_SETUP_VARCACHE_SEPARATOR'
+    timeout = float(os.environ.get('TASK_SETUP_EMBEDDED_TIMEOUT','600')) #Seconds to wait for the persistent shell
+    volatile = False
+
+    def __init__(self,cfg=None,varcache=None,verbosity=0):
+        """Class constructor"""
+        self.cfg = cfg
+        self.varcacheFile = varcache
+        self.varcacheReady = False
+        self.verbosity = verbosity
+        self.proc = None
+        self.failed = False
+        self.expired = False
+        self.tmpdir = None
+        self.count = 0
+        self.digest = None
+
+    def namespace(self,set=None):
+        """Return a digest of the namespace in which commands are evaluated"""
+        if self.digest: return(self.digest)
+        digest = hashlib.md5()
+        for name in (self.cfg,self.varcacheFile):
+            try:
+                fd = open(name,'rb')
+                try:
+                    digest.update(fd.read())
+                finally:
+                    fd.close()
+            except (IOError,TypeError):
+                pass
+        namespace = set and set or os.environ
+        for key in sorted(namespace.keys()):
+            digest.update(key+'='+namespace[key]+'\n')
+        self.digest = digest.hexdigest()
+        return(self.digest)
+
+    def _environment(self):
+        """Return the shell commands needed to set up the evaluation environment"""
+        if (self.varcacheFile) and self.fillVarcache():
+            return('. '+shellQuote(self.varcacheFile))
+        return((self.cfg) and '. '+shellQuote(os.path.abspath(self.cfg)) or 'true')
+
+    @profiled('varcache')
+    def _generateVarcache(self):
+        """Return the variables exported by the configuration file, sourced in a single shell call"""
+        shell = which(self.varcache_shell,verbose=False)
+        if not shell: shell = self.shell
+        script = 'export -p ; echo '+self.varcache_marker+' ; set -a ; . '+shellQuote(os.path.abspath(self.cfg))+ \
+            ' </dev/null >/dev/null 2>&1 ; set +a ; echo '+self.varcache_marker+' ; export -p'
+        (status,output,error) = executor.command(shellQuote(shell)+' -c '+shellQuote(script)).result()
+        try:
+            (before,sourced,after) = output.split(self.varcache_marker+'\n')
+        except ValueError:
+            error = error.rstrip('\n')
+            print "Warning: unable to generate the variable cache for "+str(self.cfg)+(error and ": "+error or "")
+            return(None)
+        before = set(before.splitlines())
+        return(''.join([line+'\n' for line in after.splitlines() if not line in before]))
+
+    def fillVarcache(self):
+        """Write the variable cache file from the cache shared by tasks sourcing the same configuration"""
+        if self.varcacheReady: return(True)
+        try:
+            if os.path.getsize(self.varcacheFile) > 0: return(True)
+        except OSError:
+            pass
+        contents = ''
+        if self.cfg and os.path.exists(self.cfg):
+            try:
+                fd = open(self.cfg,'rb')
+                try:
+                    config_digest = hashlib.md5(fd.read()).hexdigest()
+                finally:
+                    fd.close()
+            except IOError:
+                print "Warning: configuration file "+self.cfg+" does not exist or is not readable"
+                return(False)
+            environment = hashlib.md5()
+            for key in sorted(os.environ.keys()):
+                environment.update(key+'='+os.environ[key]+'\n')
+            key = varcacheCache.key('varcache',config_digest,environment.hexdigest())
+            contents = varcacheCache.lookup(key)
+            if contents is None:
+                contents = self._generateVarcache()
+                if contents is None:
+                    # An empty cache (as left by a failed generation) keeps the configuration from being re-sourced
+                    contents = ''
+                else:
+                    varcacheCache.store(key,contents)
+            else:
+                profiler.count('varcache:cached')
+        try:
+            fd = open(self.varcacheFile,'wb')
+            try:
+                fd.write(contents)
+            finally:
+                fd.close()
+        except IOError:
+            print "Warning: unable to write the variable cache "+self.varcacheFile
+            return(False)
+        self.varcacheReady = True
+        return(True)
+
+    def _assignments(self,internals):
+        """Return shell assignments for internal variables"""
+        return(''.join([str(var)+'='+str(internals[var])+'; ' for var in internals.keys() if var is not None]))
+
+    def _readFile(self,name):
+        """Return the contents of a file in the working directory of the shell"""
+        fd = open(os.path.join(self.tmpdir,name),'rb')
+        try:
+            return(fd.read())
+        finally:
+            fd.close()
+
+    def _start(self):
+        """Start the shell and source the environment once"""
+        import subprocess
+        self.tmpdir = tempfile.mkdtemp(prefix='task_setup_shell')
+        try:
+            # The shell leads its own process group so that a hanging command can be killed with it
+            self.proc = subprocess.Popen([self.shell],stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                         stderr=open(os.path.join(self.tmpdir,'shell_err'),'wb'),preexec_fn=os.setpgrp)
+        except OSError:
+            self.failed = True
+            return
+        self.proc.stdin.write('{ '+self._environment()+' ; } </dev/null >/dev/null 2>'+self.tmpdir+'/setup_err\n')
+        if self._wait(self.marker) is None:
+            if self.expired: print "Warning: no reply from the shell for embedded commands after "+str(self.timeout)+" seconds"
+            self.close(kill=True)
+            self.failed = True
+            return
+        error_message = self._readFile('setup_err').rstrip('\n')
+        if error_message:
+            print "Warning: environment setup for embedded commands returned an error: "+error_message
+
+    def _wait(self,marker):
+        """Request the exit status of the last command and wait for the reply (None if the shell exits or times out)"""
+        import select
+        try:
+            self.proc.stdin.write('echo '+marker+' $?\n')
+            self.proc.stdin.flush()
+        except IOError:
+            return(None)
+        fd = self.proc.stdout.fileno()
+        deadline = time() + self.timeout
+        buffer = ''
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0 or not select.select([fd],[],[],remaining)[0]:
+                self.expired = True
+                return(None)
+            data = os.read(fd,4096)
+            if not data: return(None)
+            buffer += data
+            lines = buffer.split('\n')
+            buffer = lines.pop()
+            for line in lines:
+                if line.startswith(marker+' '): return(line.split()[-1])
+
+    def _runOnce(self,command,internals):
+        """Execute a command in a dedicated shell (fallback)"""
+        command_prefix = '{ '+self._environment()+' ; } >/dev/null 2>&1 ; '+self._assignments(internals)
+        (status,outbuf,error_message) = executor.command(command_prefix+command).result()
+        return(outbuf,error_message)
+
+    @profiled('embedded')
+    def run(self,command,internals={}):
+        """Execute a command in the persistent shell and return its (stdout,stderr)"""
+        if not self.proc and not self.failed: self._start()
+        if self.failed: return(self._runOnce(command,internals))
+        self.count += 1
+        # The command is sourced from a file so that syntax errors stay within its subshell
+        script = os.path.join(self.tmpdir,'cmd'+str(self.count))
+        fd = open(script,'wb')
+        try:
+            fd.write(command+'\n')
+        finally:
+            fd.close()
+        try:
+            self.proc.stdin.write('( '+self._assignments(internals)+'. '+shellQuote(script)+' ) </dev/null >'+
+                                  shellQuote(os.path.join(self.tmpdir,'out'))+' 2>'+shellQuote(os.path.join(self.tmpdir,'err'))+'\n')
+        except IOError:
+            pass
+        if self._wait(self.marker+str(self.count)) is None:
+            # The shell has exited or hangs: execute all subsequent commands in their own shells
+            self.close(kill=True)
+            self.failed = True
+            if self.expired: return('','no reply from the command after '+str(self.timeout)+' seconds (killed)')
+            return(self._runOnce(command,internals))
+        os.unlink(script)
+        return(self._readFile('out'),self._readFile('err'))
+
+    def close(self,kill=False):
+        """Shut down (or kill) the shell and remove its working directory"""
+        if self.proc:
+            if kill:
+                import signal
+                try:
+                    os.killpg(self.proc.pid,signal.SIGKILL)
+                except OSError:
+                    pass
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+            self.proc.wait()
+            self.proc = None
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir,ignore_errors=True)
+            self.tmpdir = None
+
+class LoopSteps(object):
+    """Lazily generated, formatted values of a section loop variable"""
+
+    def __init__(self,start,end,step=1):
+        """Class constructor"""
+        self.format_string = "%0"+str(len(start))+"d"
+        self.steps = xrange(int(start),int(end)+1,int(step))
+
+    def __iter__(self):
+        """Generate the formatted loop values"""
+        for i in self.steps:
+            yield(self.format_string % (i))
+
+    def __len__(self):
+        """Number of steps in the loop"""
+        return(len(self.steps))
+
+class Entry(object):
+    """Link or copy requested by a configuration line (also accessible as a mapping of its fields)"""
+
+    __slots__ = ('link','link_host','target','target_host','target_type','copy','copy_method',
+                 'cleanup','create_target','link_only','evaluated')
+
+    def __init__(self,link,target,target_host=None,target_type='file',link_host=None,copy=False,copy_method=None,
+                 cleanup=False,create_target=False,link_only=False,evaluated=True):
+        """Class constructor"""
+        self.link = link
+        self.link_host = link_host and intern(link_host) or None
+        self.target = target
+        if target_host is None: target_host = [None for item in target]
+        self.target_host = [host and intern(host) or None for host in target_host]
+        self.target_type = target_type
+        self.copy = copy
+        self.copy_method = copy_method
+        self.cleanup = cleanup
+        self.create_target = create_target
+        self.link_only = link_only
+        self.evaluated = evaluated
+
+    def __getstate__(self):
+        """Return the picklable state of the entry"""
+        return(tuple([getattr(self,name) for name in self.__slots__]))
 
-    def _setPrefixes(self):
-        """Set hosts and prefixes for entries"""
-        self.src_file_prefix = [target_host and target_host+':' or '' for target_host in self.host]
+    def __setstate__(self,state):
+        """Restore the entry from its pickled state"""
+        for (name,value) in zip(self.__slots__,state):
+            setattr(self,name,value)
+        self.link_host = self.link_host and intern(self.link_host) or None
+        self.target_host = [host and intern(host) or None for host in self.target_host]
 
-    def _sourceTypes(self):
-        """Determine the type of source"""
-        self.remote_file_type = ['' for src in self.true_src_file]
-        for host in set(self.host):
-            if not host: continue
-            idx = []
-            for i in range(0,len(self.true_src_file)):                
-                if self.host[i] == host:
-                    idx.append(i)
-            check_file = "ssh "+host+" '"
-            for i in idx:
-                check_file += ' if [[ -d "'+self.true_src_file[i]+ \
-                    '" ]] ; then echo 2 ; elif [[ -f "'+self.true_src_file[i]+ \
-                    '" ]] ; then echo 1 ; else echo 0 ; fi;'
-            check_file.rstrip(';')
-            check_file += "'"
-            if self.have_subprocess:
-                import subprocess
-                p = subprocess.Popen(check_file,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-                output = p.stdout.read().rstrip('\n')
-                error = p.stderr.read()
-            else:
-                (stdin,stdout,stderr) = os.popen3(check_file,'r')
-                output = stdout.read().rstrip('\n')
-                error = stderr.read()
-            if len(error) > 0:
-                warnline = "Warning: STDERR returned from "+self.host[i]+" is "+error
-                sys.stderr.write(warnline+'\n')
-                if (self.verbosity): print warnline                    
-            if len(output) > 0:
-                output_list = output.split('\n')
-                for i in range(0,len(idx)):
-                    try:
-                        ftype = int(output_list[i])
-                    except:
-                        if not self.link_only:
-                            print "Warning: required file "+self.true_src_file[i]+" does not exist on host "+self.host[i]
-                    if ftype == 1:
-                        self.remote_file_type[idx[i]] = 'file'
-                    elif ftype == 2:
-                        self.remote_file_type[idx[i]] = 'directory'
-            else:
-                print "Warning: unable to login to target host "+self.host[i]+". See previous error statement for STDERR details."
+    def __getitem__(self,key):
+        """Return a field of the entry"""
+        try:
+            return(getattr(self,key))
+        except (AttributeError,TypeError):
+            raise KeyError(key)
 
-    def rephost(self):
-        """Repeat host entry for all targets"""
-        self.src.extend(self.target)
-        self.host.extend([self.target_host[0] for item in self.target])
+    def __setitem__(self,key,value):
+        """Set a field of the entry"""
+        if not key in self.__slots__: raise KeyError(key)
+        setattr(self,key,value)
+
+    def has_key(self,key):
+        """Determine whether the entry has a field"""
+        return(key in self.__slots__)
+
+    def get(self,key,default=None):
+        """Return a field of the entry, or a default value for unknown fields"""
+        if not key in self.__slots__: return(default)
+        return(getattr(self,key))
 
 class Section(list):
     """Data and functions applicable to individual configuration sections"""
@@ -350,22 +1652,26 @@ class Section(list):
     verbosity = 0
     cleanup = False
     force = False
+    execute = True
+    lastSlash = re.compile('/$',re.M)
+    noval = re.compile('^\s*[\'\"]*<no\svalue>',re.M)
+    comment = re.compile('^#',re.M)
 
-    def __init__(self,section,set=None,cfg=None,attrib={},varcache=None):
+    def __init__(self,section,set=None,cfg=None,attrib={},varcache=None,shell=None):
         """Class constructor"""
         self.section = section
         self.set = set
         self.cfg = cfg
         self.attrib = attrib
         self.varcacheFile = varcache
+        self.shell = shell and shell or EmbeddedShell(cfg=cfg,varcache=varcache)
         no_loop = {'var':None,'steps':list('0')}
         self.loop = copy.copy(no_loop)
         if self._isType('loop'):
             try:
                 self.loop['var'] = self.attrib['var']
                 step = self.attrib.has_key('step') and int(self.attrib['step']) or 1
-                format_string = "%0"+str(len(self.attrib['start']))+"d"
-                self.loop['steps'] = [format_string % (i) for i in range(int(self.attrib['start']),int(self.attrib['end'])+1,step)]
+                self.loop['steps'] = LoopSteps(self.attrib['start'],self.attrib['end'],step)
             except KeyError:
                 self.loop = no_loop
                 warnline = "Warning: incomplete loop specification for <"+section+"> - no looping for this section"
@@ -377,6 +1683,13 @@ class Section(list):
                 sys.stderr.write(warnline+'\n')
                 if (self.verbosity): print warnline
 
+    def __getstate__(self):
+        """Return the picklable state of the section (the namespace and shell belong to the run)"""
+        state = self.__dict__.copy()
+        for name in ('set','shell','varcacheFile'):
+            del state[name]
+        return(state)
+
     def _isType(self,check_type):
         """Determine whether this section is of a specific type"""
         return(self.attrib.has_key('type') and self.attrib['type'] or None)
@@ -399,35 +1712,34 @@ class Section(list):
         """Resolve special keywords in the entry"""
         return resolveKeywords(entry,delim_exec=self.delimiter_exec,set=self.set,verbose=self.verbosity,internals=internals)
 
+    def _runEmbedded(self,command,internals={}):
+        """Execute an embedded command or reuse the result of an identical earlier execution"""
+        if self.attrib.get('cache','yes').lower() in ('no','false','0'):
+            self.shell.volatile = True
+            return(self.shell.run(command,internals=internals))
+        # Internals are part of the key only if the command could possibly see them
+        namespace = self.set and self.set or os.environ
+        assignments = [(var,internals[var]) for var in sorted(internals.keys())
+                       if var is not None and (var in command or namespace.has_key(var))]
+        key = embeddedCache.key(self.shell.namespace(self.set),command,assignments)
+        result = embeddedCache.lookup(key)
+        if result is not None: profiler.count('embedded:cached')
+        if result is None:
+            result = self.shell.run(command,internals=internals)
+            if result[1]:
+                self.shell.volatile = True
+            else:
+                embeddedCache.store(key,result)
+        return(result)
+
     def _executeEmbedded(self,entry,internals={}):
         """Execute backtic embedded commands and substitute result"""
-        have_subprocess=True
-        try:
-            import subprocess
-        except ImportError:
-            have_subprocess=False
         updated = [entry]
         delim = re.compile(self.delimiter_exec+'(.*?)'+self.delimiter_exec)
-        shell_dot_config = (self.cfg) and '. '+self.cfg+' >/dev/null 2>&1; ' or 'true; '
-        if (self.varcacheFile):
-            shell_gen_cachefile = 'task_setup_cachegen '+self.cfg+' '+self.varcacheFile+' ; . '+self.varcacheFile+' ; '
-            command_prefix = 'if [[ -s '+self.varcacheFile+' ]] ; then . '+self.varcacheFile+' >/dev/null 2>&1 ; else '+shell_gen_cachefile+'fi ; '
-        else:
-            command_prefix = shell_dot_config
-        for command in delim.finditer(entry):            
-            for var in internals.keys():
-                command_prefix = command_prefix+str(var)+'='+str(internals[var])+'; '                
-            if have_subprocess:                
-                p = subprocess.Popen(command_prefix+command.group(1),shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-                error_message = p.stderr.read().rstrip('\n')
-                outbuf = p.stdout.read().rstrip('\n ')
-            else:
-                (stdin,stdout,stderr) = os.popen3(command_prefix+command.group(1),'r')
-                error_message = stderr.read().rstrip('\n')
-                outbuf = stdout.read().rstrip('\n ')
-                stdin.close()
-                stdout.close()
-                stderr.close()                
+        for command in delim.finditer(entry):
+            (outbuf,error_message) = self._runEmbedded(command.group(1),internals=internals)
+            error_message = error_message.rstrip('\n')
+            outbuf = outbuf.rstrip('\n ')
             elements = re.split(self.delimiter_target,outbuf)
             target_list = []
             for j in range(0,len(updated)):
@@ -442,7 +1754,6 @@ class Section(list):
     def add(self,line,search_path):        
         """Add data to the section"""
         data = re.split('\s+',re.sub('^(#)+',' ',line))
-        entry = {}
         try:
             rawLink = data[1]
             rawTarget = ' '.join(data[2:]).rstrip()            
@@ -457,18 +1768,26 @@ class Section(list):
                 bin_path = self.set['PATH']
             except:
                 pass
-        lastSlash = re.compile('/$',re.M)
-        noval = re.compile('^\s*[\'\"]*<no\svalue>',re.M)
-        comment = re.compile('^#',re.M)
+        lastSlash = self.lastSlash
+        noval = self.noval
+        comment = self.comment
+        rawLinkBase = lastSlash.sub('',rawLink)
+        invariant = False
         for step in self.loop['steps']:
+            # Lines that do not depend on the loop variable are only processed for the first step
+            if invariant: break
             loopInternals={self.loop['var']:step}
-            link = self._sectionResolveKeywords(lastSlash.sub('',rawLink),internals=loopInternals)
+            link = self._sectionResolveKeywords(rawLinkBase,internals=loopInternals)
             link_split = self._splitHost([link['string']])
-            entry["link_host"] = link_split["host"][0]
-            entry["link"] = link_split["path"][0]
             target = self._sectionResolveKeywords(rawTarget,internals=loopInternals)
-            target_executed = [str(item).replace("'","").rstrip() for item in self._executeEmbedded(target['string'],internals=loopInternals)]
-            target_list = re.split(self.delimiter_target,' '.join(target_executed))
+            invariant = not (link['contains_internal'] or target['contains_internal'])
+            evaluated = self.execute or not (self.delimiter_exec and self.delimiter_exec in target['string'])
+            if evaluated:
+                target_executed = [str(item).replace("'","").rstrip() for item in self._executeEmbedded(target['string'],internals=loopInternals)]
+                target_list = re.split(self.delimiter_target,' '.join(target_executed))
+            else:
+                # Unevaluated embedded commands are kept verbatim as a single target
+                target_list = [target['string'].strip()]
             target_split = self._splitHost(target_list)
             if ([True for target_string in target_split["path"] if noval.match(target_string)]):
                 if any([True for target_string in target_split["path"] if not noval.match(target_string)]):
@@ -476,27 +1795,152 @@ class Section(list):
                 else:
                     print "Info 1: will not create link for "+link['string']+" because of special target value '<no value>'"
                     continue
-            if step != self.loop['steps'][0] and not (link['contains_internal'] or target['contains_internal']):
-                continue
-            entry["target"] = []
-            entry["target_host"] = []
+            targets = []
+            target_hosts = []
             for i in range(0,len(target_split["path"])):
                 if comment.match(target_split["path"][i]):
                     break
                 if not noval.match(target_split["path"][i]):                    
-                    entry["target_host"].append(target_split["host"][i])
-                    entry["target"].append(target_split["path"][i])
-            entry["target_type"] = (lastSlash.search(rawLink) or len(entry["target"]) > 1) and 'directory' or 'file'        
+                    target_hosts.append(target_split["host"][i])
+                    targets.append(target_split["path"][i])
+            target_type = (lastSlash.search(rawLink) or len(targets) > 1) and 'directory' or 'file'        
             if search_path:
-                entry["target"] = [which(target,path=bin_path) for target in entry["target"]]
-            entry["copy"] = False
-            entry["cleanup"] = False
-            entry["create_target"] = False
-            entry["link_only"] = False
-            if self.section == 'output':
-                entry["create_target"] = True
-                entry["link_only"] = True               
-            self.append(copy.deepcopy(entry))
+                targets = [which(target,path=bin_path) for target in targets]
+            output = self.section == 'output'
+            self.append(Entry(link_split["path"][0],targets,target_hosts,target_type,link_host=link_split["host"][0],
+                              copy=self.attrib.has_key('copy_method'),copy_method=self.attrib.get('copy_method'),
+                              create_target=output,link_only=output,evaluated=evaluated))
+
+class Trash(object):
+    """Holding area for task subdirectories that are deleted in the background"""
+
+    # Class variables
+    name = '.task_setup_trash'
+
+    def __init__(self,taskdir):
+        """Class constructor"""
+        self.directory = os.path.join(os.path.dirname(os.path.abspath(taskdir)),self.name)
+        self.batch = None
+
+    def discard(self,path):
+        """Move a directory into the trash, removing it in place if it cannot be renamed"""
+        try:
+            if not self.batch:
+                mkdir_p(self.directory)
+                self.batch = tempfile.mkdtemp(dir=self.directory,prefix=os.path.basename(os.path.dirname(os.path.abspath(path)))+'.')
+            os.rename(path,os.path.join(self.batch,os.path.basename(path)))
+        except OSError:
+            shutil.rmtree(path)
+
+    def contents(self):
+        """Return the batches currently held in the trash"""
+        try:
+            return([os.path.join(self.directory,entry) for entry in os.listdir(self.directory)])
+        except OSError:
+            return([])
+
+    def empty(self):
+        """Delete everything held in the trash"""
+        for batch in self.contents():
+            shutil.rmtree(batch,ignore_errors=True)
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+    def reap(self,wait=False):
+        """Empty the trash, in a detached background process unless asked to wait"""
+        if wait or not self.contents():
+            self.empty()
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            pid = os.fork()
+        except OSError:
+            self.empty()
+            return
+        if pid > 0:
+            os.waitpid(pid,0)
+            return
+        try:
+            os.setsid()
+            if os.fork() == 0:
+                null = os.open(os.devnull,os.O_RDWR)
+                for fd in range(3): os.dup2(null,fd)
+                os.closerange(3,os.sysconf('SC_OPEN_MAX'))
+                os.nice(10)
+                self.empty()
+        finally:
+            os._exit(0)
+
+class Manifest(dict):
+    """Record of the links, copies and directories created by a task setup"""
+
+    # Class variables
+    name = 'task_setup_manifest.json'
+
+    def __init__(self,taskdir,digest=None):
+        """Class constructor"""
+        self.taskdir = taskdir
+        self.digest = digest
+        self.previous = {}
+        self.previous_digest = None
+
+    def _key(self,dest):
+        """Return the manifest key (path relative to the task directory) for a destination"""
+        return(os.path.relpath(dest,self.taskdir))
+
+    def load(self,directory):
+        """Read the manifest left by a previous setup"""
+        try:
+            fd = open(os.path.join(directory,self.name),'rb')
+            try:
+                data = json.load(fd)
+            finally:
+                fd.close()
+            self.previous_digest = data['digest']
+            self.previous = dict([(str(key),[str(value[0]),str(value[1]),value[2]]) for (key,value) in data['entries'].items()])
+        except (IOError,ValueError,KeyError,TypeError,IndexError):
+            self.previous = {}
+
+    def add(self,dest,kind,target,stat=None):
+        """Record a destination created (or kept) by this setup"""
+        self[self._key(dest)] = [kind,target,stat]
+
+    def unchanged(self,dest,kind,target,stat=None):
+        """Check whether the previous setup left an identical destination in place"""
+        if self.previous.get(self._key(dest)) != [kind,target,stat]: return(False)
+        try:
+            if kind == 'link':
+                return(os.readlink(dest) == target)
+            return(os.path.isfile(dest) and not os.path.islink(dest))
+        except OSError:
+            return(False)
+
+    def previousKind(self,dest):
+        """Return the kind of destination recorded by the previous setup"""
+        return(self.previous.get(self._key(dest),[None])[0])
+
+    def stale(self):
+        """Return the destinations of the previous setup that are not part of this one (deepest first)"""
+        stale = [key for key in self.previous.keys() if not self.has_key(key)]
+        stale.sort()
+        stale.reverse()
+        return([(os.path.join(self.taskdir,key),self.previous[key][0]) for key in stale])
+
+    def write(self,directory):
+        """Save the manifest atomically"""
+        try:
+            (fdunit,tmpname) = tempfile.mkstemp(dir=directory,prefix='.'+self.name)
+            fd = os.fdopen(fdunit,'wb')
+            try:
+                json.dump({'digest':self.digest,'entries':self},fd)
+            finally:
+                fd.close()
+            os.rename(tmpname,os.path.join(directory,self.name))
+        except (IOError,OSError):
+            print "Warning: unable to write setup manifest to "+directory
 
 class Config(dict):
     """Data and functions applicable to the task setup"""
@@ -510,6 +1954,12 @@ class Config(dict):
     verbosity = 0
     cleanup = False
     force = False
+    jobs = 1
+    incremental = False
+    clean_mode = 'remove'
+    copy_method = 'auto'
+    remote_expansions = None
+    keep_inputs = False
     error = 0
     ok = 1
     subdir_sectionMap = {'input':       'input',
@@ -522,16 +1972,18 @@ class Config(dict):
     ignore_sections = ['seq_scheduler']            #Ignore these sections in the configuration file
     varcache_name = 'task_setup_varcache.txt'      #Name for environment caching in embedded commands
 
-    def __init__(self,file=None,taskdir=None,set=None,varcache=None):
+    def __init__(self,file=None,taskdir=None,set=None,varcache=None,tmpfiles=True):
         """Class constructor"""
         self.configFile = file
         self.taskdir = taskdir
         self.setFile = set
         self.set = None
         self.sectionList = []
-        self.callFile = self._createTmpFile(sys.argv)
-        self.envFile = self._createTmpFile(os.environ)
-        self.varcacheFile = (varcache) and varcache or self._createTmpFile(None)
+        self.callFile = (tmpfiles) and self._createTmpFile(sys.argv) or None
+        self.envFile = (tmpfiles) and self._createTmpFile(os.environ) or None
+        self.varcacheFile = varcache
+        if tmpfiles and not varcache: self.varcacheFile = self._createTmpFile(None)
+        self.shell = EmbeddedShell(cfg=file,varcache=self.varcacheFile)
         self["file"] = file
         if set:
             self._readSetFile(set) 
@@ -540,8 +1992,9 @@ class Config(dict):
 
     def __del__(self):
         """Class destructor"""
-        os.unlink(self.callFile)
-        os.unlink(self.envFile)
+        self.shell.close()
+        for tmpfile in (self.callFile,self.envFile):
+            if tmpfile: os.unlink(tmpfile)
 
     def _createTmpFile(self,contents):
         """Create and fill a temporary file, returning the file name"""
@@ -564,35 +2017,48 @@ class Config(dict):
         fd.close()
         return(filename)
 
+    @profiled('config:set')
     def _readSetFile(self,file):
         """Read set file"""
         try:
+            digest = hashlib.md5()
             fd = open(file,"rb")
-            setData = fd.readlines()
+            try:
+                for block in iter(lambda: fd.read(1024*1024),''):
+                    digest.update(block)
+                key = namespaceCache.key('set',digest.hexdigest())
+                self.set = namespaceCache.lookup(key)
+                if self.set is None:
+                    fd.seek(0)
+                    self.set = self._parseSet(fd)
+                    namespaceCache.store(key,self.set)
+            finally:
+                fd.close()
         except IOError:
             print "Warning: unable to read set from "+file
             self.set = None
             return()
-        fd.close()
-        sep = re.compile(r"(?<!\\)'")
-        equal = re.compile("=")
+
+    def _parseSet(self,lines):
+        """Parse the output of the shell 'set' command in a single pass"""
+        set = {}
         quote_count = 0
-        self.set = {}; concat_line = ''
-        for line in setData:
-            quote_count += len(re.findall(sep,line))
-            if quote_count%2 == 0:
-                concat_line += line
-                try:
-                    (key,value) = equal.split(concat_line,maxsplit=1)
-                except ValueError:
-                    if quote_count == 0:
-                        concat_line = ''
-                    continue
-                self.set[key] = value.rstrip('\n')
-                concat_line = ''
-            else:
-                concat_line += line
+        pending = []
+        for line in lines:
+            # Count quotes that are not escaped by a backslash
+            quote_count += line.count("'") - line.count("\\'")
+            pending.append(line)
+            if quote_count%2: continue
+            concat_line = len(pending) == 1 and line or ''.join(pending)
+            pending = []
+            try:
+                (key,value) = concat_line.split('=',1)
+            except ValueError:
+                continue
+            set[key] = value.rstrip('\n')
+        return(set)
 
+    @profiled('config:read')
     def _readConfigFile(self,file):
         """Read configuration file"""
         if not file:
@@ -641,17 +2107,26 @@ class Config(dict):
         else:
             return(subdirs)
 
+    def _removeSubdir(self,path):
+        """Remove a task subdirectory according to the cleanup mode"""
+        if self.clean_mode == 'trash':
+            self.trash.discard(path)
+        else:
+            shutil.rmtree(path)
+
+    @profiled('taskdir')
     def _taskdir_setup(self):
         """Set up task base directory"""
         status = self.ok
-        if self.cleanup:
+        self.trash = Trash(self.taskdir)
+        if self.cleanup and not self.incremental:
             if os.path.isdir(self.taskdir):
                 contents = [entry for entry in os.listdir(self.taskdir) if os.path.isdir(os.path.join(self.taskdir,entry))]
                 if len(contents) > 0:
                     if self.force:
                         for sub in contents:
                             try:
-                                shutil.rmtree(os.path.join(self.taskdir,sub))
+                                self._removeSubdir(os.path.join(self.taskdir,sub))
                             except:
                                 print "Error: unable to force clean workspace subdirectory "+sub
                                 return(self.error)
@@ -660,7 +2135,7 @@ class Config(dict):
                         if contents == self._get_subdirs(self.taskdir,absolute=False):
                             for sub in self._get_subdirs(self.taskdir,absolute=True):
                                 try:                                
-                                    shutil.rmtree(sub)
+                                    self._removeSubdir(sub)
                                 except:
                                     print "Error: unable to remove task subdirectory "+sub
                                     return(self.error)
@@ -672,6 +2147,7 @@ class Config(dict):
                             print "       Task subdirectories: "+str(contents)
                             print "       Mapped config sections: "+str(self._get_subdirs(self.taskdir,absolute=False))
                             return(self.error)
+                if self.clean_mode == 'trash': self.trash.reap()
         if not os.path.isdir(self.taskdir):
             try:
                 mkdir_p(self.taskdir)
@@ -698,116 +2174,43 @@ class Config(dict):
 
     def _special_appends(self):
         """Add special values to sections"""
-        self._append_meta("setup",{"link":"task_setup",
-                                   "target":[sys.argv[0]],
-                                   "target_type":'file',
-                                   "target_host":[None],
-                                   "copy":False,
-                                   "cleanup":False,
-                                   "create_target":False,
-                                   "link_host":None,
-                                   "link_only":False})
+        self._append_meta("setup",Entry("task_setup",[sys.argv[0]]))
         if self["file"]:
-            self._append_meta("setup",{"link":"task_setup.cfg",
-                                       "target":[self.configFile],
-                                       "target_type":'file',
-                                       "target_host":[None],
-                                       "copy":True,
-                                       "cleanup":False,
-                                       "create_target":False,
-                                       "link_host":None,
-                                       "link_only":False})
+            self._append_meta("setup",Entry("task_setup.cfg",[self.configFile],copy=True))
         if self.varcacheFile:
-            self._append_meta("setup",{"link":"task_setup_varcache.txt",
-                                       "target":[self.varcacheFile],
-                                       "target_type":'file',
-                                       "target_host":[None],
-                                       "copy":True,
-                                       "cleanup":True,
-                                       "create_target":False,
-                                       "link_host":None,
-                                       "link_only":False})            
-        self._append_meta("setup",{"link":"task_setup_call.txt",
-                                   "target":[self.callFile],
-                                   "target_type":'file',
-                                   "target_host":[None],
-                                   "copy":True,
-                                   "cleanup":False,
-                                   "create_target":False,
-                                   "link_host":None,
-                                   "link_only":False})
-        self._append_meta("setup",{"link":"task_setup_env.txt",
-                                   "target":[self.envFile],
-                                   "target_host":[None],
-                                   "target_type":'file',
-                                   "copy":True,
-                                   "cleanup":False,
-                                   "create_target":False,
-                                   "link_host":None,
-                                   "link_only":False})
+            # Embedded command results may all come from the caches, leaving the variable cache to be filled here
+            if Section.delimiter_exec and Section.delimiter_exec in ''.join(self.configData): self.shell.fillVarcache()
+            self._append_meta("setup",Entry("task_setup_varcache.txt",[self.varcacheFile],copy=True,cleanup=not self.keep_inputs))
+        self._append_meta("setup",Entry("task_setup_call.txt",[self.callFile],copy=True))
+        self._append_meta("setup",Entry("task_setup_env.txt",[self.envFile],copy=True))
         if self.setFile:
-            self._append_meta("setup",{"link":"task_setup_set.txt",
-                                       "target":[self.setFile],
-                                       "target_type":'file',
-                                       "target_host":[None],
-                                       "copy":True,
-                                       "cleanup":True,
-                                       "create_target":False,
-                                       "link_host":None,
-                                       "link_only":False})
+            self._append_meta("setup",Entry("task_setup_set.txt",[self.setFile],copy=True,cleanup=not self.keep_inputs))
         cachegen = which('task_setup_cachegen',verbose=self.verbosity)
         if cachegen:
-            self._append_meta("setup",{"link":"task_setup_cachegen",
-                                       "target":[cachegen],
-                                       "target_type":'file',
-                                       "target_host":[None],
-                                       "copy":False,
-                                       "cleanup":False,
-                                       "create_target":False,
-                                       "link_host":None,
-                                       "link_only":False})
+            self._append_meta("setup",Entry("task_setup_cachegen",[cachegen]))
         true_path=which('true_path',verbose=self.verbosity)
         if true_path:
-            self._append_meta("setup",{"link":"task_setup_truepath",
-                                       "target":[true_path],
-                                       "target_type":'file',
-                                       "target_host":[None],
-                                       "copy":False,
-                                       "cleanup":False,
-                                       "create_target":False,
-                                       "link_host":None,
-                                       "link_only":False})
+            self._append_meta("setup",Entry("task_setup_truepath",[true_path]))
         return(self.ok) 
 
+    @profiled('create_target')
     def _createTarget(self,entry,host,path):
         """Create target directory"""
-        have_subprocess=True
-        try:
-            import subprocess
-        except ImportError:
-            have_subprocess=False     
         status = self.ok
-        if not entry["create_target"]: return(status)
-        directory = (entry["target_type"] == 'directory') and path or os.path.split(path)[0]
+        if not entry.create_target: return(status)
+        directory = (entry.target_type == 'directory') and path or os.path.split(path)[0]
         if not directory:
-            print "Error: no directory specified target in request for "+entry["link"]
+            print "Error: no directory specified target in request for "+entry.link
             status = self.error
             return(status)
         if host:
-            make_dir = "echo \"s.mkdir_onebyone "+directory+"; if [[ -d "+directory+ \
-                       " ]] ; then echo TASK_SETUP_SUCCESS ; else echo TASK_SETUP_FAILURE ; fi\" | ssh "+ \
-                       host+" bash --login"
-            if have_subprocess:
-                p = subprocess.Popen(make_dir,shell=True,stderr=subprocess.PIPE,stdout=subprocess.PIPE)
-                error = p.stderr.read()
-                output = p.stdout.read()
+            if self.remote_targets.has_key((host,directory)):
+                (output,error) = (self.remote_targets[(host,directory)],'')
             else:
-                (stdin,stdout,stderr) = os.popen3(make_dir,'r')
-                error = stderr.read()
-                output = stdout.read()
-            if not re.search("TASK_SETUP_SUCCESS",output):
+                (output,error) = remoteSessions.session(host).request('mkdir',[directory])
+            if not output or not output[0]:
                 status = self.error
-                if re.search("TASK_SETUP_FAILURE",output):
+                if output:
                     print "Error: login to "+host+" successful but "+directory+" not created"
                 else:
                     print "Error: unable to obtain directory status on "+host
@@ -823,6 +2226,130 @@ class Config(dict):
                     status = self.error                    
         return(status)
 
+    @profiled('remote:create_target')
+    def _createRemoteTargets(self):
+        """Create the remote target directories of all entries using a single request per host"""
+        self.remote_targets = {}
+        directories = {}
+        for section in self["sections"].keys():
+            for entry in self["sections"][section]:
+                if not entry.create_target: continue
+                for (host,target) in zip(entry.target_host,entry.target):
+                    if not host: continue
+                    # Directories holding targets found by the remote glob of the host are known to exist there
+                    expanded = None
+                    if (host,target) in self.remote_expanded: expanded = self.expansion.get((host,target))
+                    for path in expanded or [target]:
+                        directory = (entry.target_type == 'directory') and path or os.path.split(path)[0]
+                        if not directory or self.remote_targets.has_key((host,directory)): continue
+                        if expanded:
+                            self.remote_targets[(host,directory)] = [True]
+                        else:
+                            self.remote_targets[(host,directory)] = None
+                            directories.setdefault(host,[]).append(directory)
+        jobs = dict([(host,executor.remote(host,'mkdir',directories[host])) for host in directories.keys()])
+        for host in directories.keys():
+            (output,error) = jobs[host].result()
+            for i in range(0,len(directories[host])):
+                try:
+                    self.remote_targets[(host,directories[host][i])] = [output[i]]
+                except (IndexError,TypeError):
+                    self.remote_targets[(host,directories[host][i])] = output
+            if len(error) > 0:
+                sys.stderr.write("task_setup.py::_createTarget() attempt to connect to "+host+" returned STDERR "+error+"\n")
+        return(self.ok)
+
+    @profiled('remote:expand')
+    def _expandRemoteTargets(self):
+        """Expand the wildcards of all remote targets using a single request per host"""
+        self.expansion = {}
+        self.remote_expanded = set()
+        patterns = {}
+        for section in self["sections"].keys():
+            for entry in self["sections"][section]:
+                for (host,target) in zip(entry.target_host,entry.target):
+                    if not host or self.expansion.has_key((host,target)): continue
+                    self.expansion[(host,target)] = statCache.expand(target)
+                    if len(self.expansion[(host,target)]) < 1:
+                        if self.remote_expansions and self.remote_expansions.has_key((host,target)):
+                            self.expansion[(host,target)] = self.remote_expansions[(host,target)]
+                            self.remote_expanded.add((host,target))
+                        else:
+                            patterns.setdefault(host,[]).append(target)
+        jobs = dict([(host,executor.remote(host,'glob',patterns[host])) for host in patterns.keys()])
+        for host in patterns.keys():
+            (output,error) = jobs[host].result()
+            if len(error) > 0:
+                warnline = "Warning: STDERR returned from "+host+" is "+error
+                sys.stderr.write(warnline+'\n')
+                if (self.verbosity): print warnline
+            if output is None: continue
+            for (target,src_expanded) in zip(patterns[host],output):
+                self.expansion[(host,target)] = src_expanded
+                self.remote_expanded.add((host,target))
+                if self.remote_expansions is not None: self.remote_expansions[(host,target)] = src_expanded
+        return(self.ok)
+
+    def _planRemote(self,host,targets):
+        """Expand and type the remote targets of a host for the plan"""
+        expansion = {}
+        (matches,error) = remoteSessions.session(host).request('glob',targets)
+        if matches is None: return(expansion)
+        paths = sorted(set([path for paths in matches for path in paths]))
+        (types,error) = remoteSessions.session(host).request('ftype',paths)
+        types = dict(zip(paths,[{2:'directory',1:'file'}.get(code,'missing') for code in (types or [])]))
+        for (target,paths) in zip(targets,matches):
+            expansion[(host,target)] = [{'path':path,'type':types.get(path,'unknown')} for path in paths]
+        return(expansion)
+
+    def plan(self,stat=False,remote=False):
+        """Describe the directories, links and copies that link() would create without acting on them"""
+        plan = {'taskdir':self.taskdir,'directories':[],'entries':[]}
+        statCache.reset()
+        sections = self["sections"].keys()
+        plan['directories'] = [self._map(section) for section in sections]
+        expansion = {}
+        if remote:
+            patterns = {}
+            for section in sections:
+                for entry in self["sections"][section]:
+                    for (host,target) in zip(entry.target_host,entry.target):
+                        if host and entry.evaluated: patterns.setdefault(host,set()).add(target)
+            jobs = dict([(host,executor.submit(host,self._planRemote,host,sorted(patterns[host])))
+                         for host in patterns.keys()])
+            for host in patterns.keys():
+                expansion.update(jobs[host].result())
+        for section in sections:
+            subdir = self._map(section)
+            for entry in self["sections"][section]:
+                link_only = entry.link_only
+                if entry.copy and not link_only:
+                    kind = (entry.cleanup) and 'move' or 'copy'
+                else:
+                    kind = 'link'
+                sources = []
+                for (host,target) in zip(entry.target_host,entry.target):
+                    source = {'host':host,'path':target}
+                    if not entry.evaluated:
+                        pass
+                    elif host and remote:
+                        source['matches'] = expansion.get((host,target),[])
+                    elif not host and stat and target:
+                        paths = sorted(statCache.expand(target))
+                        source['matches'] = [{'path':path,'type':ftype and ftype or 'missing'}
+                                             for (path,ftype) in zip(paths,statCache.kinds(paths))]
+                    sources.append(source)
+                matches = sum([len(source.get('matches',[None])) for source in sources])
+                directory = (entry.target_type == 'directory' and not link_only) or matches > 1
+                plan['entries'].append({'section':section,
+                                        'link':os.path.join(subdir,entry.link),
+                                        'kind':kind,
+                                        'directory':directory,
+                                        'create_target':entry.create_target,
+                                        'evaluated':entry.evaluated,
+                                        'sources':sources})
+        return(plan)
+
     def _parseSectionHead(self,head):
         """Parse section header into individual attributes"""
         head = resolveKeywords(head,set=self.set,verbose=self.verbosity)
@@ -837,14 +2364,101 @@ class Config(dict):
         try:            
             getattr(Section,option)
         except AttributeError:
-            print "Error: attempt to change invalid setting "+option
-            return (self.error)
-        setattr(Section,option,value)
+            if not hasattr(self,option):
+                print "Error: attempt to change invalid setting "+option
+                return (self.error)
+        else:
+            setattr(Section,option,value)
         setattr(self,option,value)
         return(self.ok)
 
+    @profiled('config:sections')
     def getSections(self):
         """Break input data into individual sections"""
+        key = self._sectionsKey()
+        if not key:
+            status = self._parseSections()
+        elif self._loadSections(key):
+            profiler.count('config:cached')
+            status = self.ok
+        else:
+            # Capture the messages generated during parsing so that they can be replayed from the cache
+            undefined = len(undef_list.saved)
+            output = OrderedOutput()
+            output.install()
+            output.capture()
+            try:
+                status = self._parseSections()
+            finally:
+                chunks = output.release()
+                output.uninstall()
+            output.emit(chunks)
+            if status == self.ok and not self.shell.volatile:
+                messages = [(stream is output.saved[1] and 'stderr' or 'stdout',text) for (stream,text) in chunks]
+                self._storeSections(key,messages,undef_list.saved[undefined:])
+        if status != self.ok: return(status)
+        for force in self.force_sections:
+            self["sections"][force] = Section(force)
+        self._special_appends()
+        return(self.ok)
+
+    def _sectionsKey(self):
+        """Return the key of the parsed sections in the cache (None if the configuration cannot be cached)"""
+        if not self.configData: return(None)
+        data = ''.join(self.configData)
+        referenced = []
+        for keyword in sorted(set(KeywordTemplate.delim.findall(data))):
+            (value,vartype) = lookupKeyword(keyword,set=self.set)
+            referenced.append((keyword,value,vartype))
+        # Embedded commands and nested keywords can see the entire namespace
+        if Section.delimiter_exec in data or [True for (keyword,value,vartype) in referenced if '$' in value]:
+            referenced.append(self.shell.namespace(self.set))
+        return(configCache.key('sections',Entry.__slots__,data,self["file"],self.verbosity,Section.verbosity,Section.execute,Section.delimiter_exec,
+                               Section.delimiter_target,self.set is None,os.environ.get('PATH'),
+                               self.set and self.set.get('PATH'),referenced))
+
+    def _searchPathState(self):
+        """Return the modification times of the directories searched for executables"""
+        state = []
+        for bin_path in (os.environ.get('PATH',''),self.set and self.set.get('PATH','') or ''):
+            for dir in re.split(':',bin_path):
+                try:
+                    state.append((dir,os.stat(dir).st_mtime))
+                except OSError:
+                    state.append((dir,None))
+        return(state)
+
+    def _storeSections(self,key,messages,undefined):
+        """Save the parsed sections in the cache"""
+        try:
+            data = cPickle.dumps((self.sectionList,self["sections"],messages,undefined,self._searchPathState()),2)
+        except (cPickle.PicklingError,TypeError):
+            return
+        configCache.store(key,data)
+
+    def _loadSections(self,key):
+        """Restore the parsed sections from the cache, returning False if they are missing or stale"""
+        data = configCache.lookup(key)
+        if data is None: return(False)
+        try:
+            (sectionList,sections,messages,undefined,state) = cPickle.loads(data)
+        except (cPickle.UnpicklingError,EOFError,ValueError,TypeError):
+            return(False)
+        if state != self._searchPathState(): return(False)
+        for section in sections.values():
+            section.set = self.set
+            section.shell = self.shell
+            section.varcacheFile = self.varcacheFile
+        self["sections"] = sections
+        self.sectionList.extend(sectionList)
+        for keyword in undefined:
+            if not keyword in undef_list.saved: undef_list(keyword)
+        for (stream,text) in messages:
+            getattr(sys,stream).write(text)
+        return(True)
+
+    def _parseSections(self):
+        """Parse the configuration file into sections"""
         currentSection = None
         prefix='^\s*#\s*'
         validLine = re.compile(prefix+'[^#](.+)',re.M)
@@ -875,13 +2489,11 @@ class Config(dict):
                             currentSection = None
                         else:                            
                             headAttrib = self._parseSectionHead(head.group(2))
-                            self["sections"][currentSection] = Section(currentSection,set=self.set,cfg=self["file"],attrib=headAttrib,varcache=self.varcacheFile)
+                            self["sections"][currentSection] = Section(currentSection,set=self.set,cfg=self["file"],attrib=headAttrib,
+                                                                     varcache=self.varcacheFile,shell=self.shell)
                             self.sectionList.append(currentSection)
                 if (currentSection and not head):
                     self["sections"][currentSection].add(line,currentSection in self.search_path_sections)
-        for force in self.force_sections:
-            self["sections"][force] = Section(force)
-        self._special_appends()
         return(self.ok)
 
     def write(self,fd):
@@ -889,142 +2501,474 @@ class Config(dict):
         for section in self.sectionList:
             fd.write('#<'+section+'>\n')
             for entry in self["sections"][section]:
-                append = (entry["target_type"] == 'directory') and '/' or ''
+                append = (entry.target_type == 'directory') and '/' or ''
                 target = ''
-                for i in range(0,len(entry["target"])):
-                    host = (entry["target_host"][i]) and entry["target_host"][i]+':' or ''
-                    target += ' '+host+entry["target"][i]
-                fd.write('# '+entry["link"]+append+' '+target+'\n')
+                for i in range(0,len(entry.target)):
+                    host = (entry.target_host[i]) and entry.target_host[i]+':' or ''
+                    target += ' '+host+entry.target[i]
+                fd.write('# '+entry.link+append+' '+target+'\n')
             fd.write('#</'+section+'>\n')
     
+    def _linkSection(self,section,abs_subdir):
+        """Perform linking operations for all entries of a section, concurrently if requested"""
+        entries = self["sections"][section]
+        jobs = min(int(self.jobs),len(entries))
+        if jobs < 2:
+            return([self._linkEntry(section,abs_subdir,entry) for entry in entries])
+        # Entries sharing a top-level link component are processed in order by a single worker
+        groups = {}
+        work = Queue.Queue()
+        for i in range(0,len(entries)):
+            key = entries[i].link.split('/')[0]
+            if not groups.has_key(key):
+                groups[key] = []
+                work.put(groups[key])
+            groups[key].append(i)
+        results = [None for entry in entries]
+        done = [threading.Event() for entry in entries]
+        abort = []
+        output = OrderedOutput()
+        def worker():
+            while not abort:
+                try:
+                    indices = work.get_nowait()
+                except Queue.Empty:
+                    return
+                for i in indices:
+                    if abort: return
+                    output.capture()
+                    try:
+                        results[i] = [self._linkEntry(section,abs_subdir,entries[i]),None]
+                    except:
+                        results[i] = [self.error,sys.exc_info()]
+                    results[i].append(output.release())
+                    done[i].set()
+        threads = []
+        output.install()
+        try:
+            for i in range(0,jobs):
+                thread = threading.Thread(target=worker)
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+            # Replay output and collect statuses in configuration file order
+            statuses = []
+            for i in range(0,len(entries)):
+                done[i].wait()
+                (entry_status,exc_info,chunks) = results[i]
+                output.emit(chunks)
+                if exc_info:
+                    abort.append(True)
+                    raise exc_info[0],exc_info[1],exc_info[2]
+                statuses.append(entry_status)
+        finally:
+            # Workers stop after their current entry once the section is aborted
+            abort.append(True)
+            for thread in threads:
+                thread.join()
+            output.uninstall()
+        return(statuses)
+
+    @profiled('link')
+    def _symlink(self,target,dest_file):
+        """Create a symbolic link unless an identical one was left in place by the previous setup"""
+        if self.incremental:
+            if self.manifest.unchanged(dest_file,'link',target):
+                self.manifest.add(dest_file,'link',target)
+                return
+            if os.path.islink(dest_file):
+                os.remove(dest_file)
+            elif os.path.isdir(dest_file) and self.manifest.previousKind(dest_file) == 'directory':
+                shutil.rmtree(dest_file)
+            elif os.path.isfile(dest_file) and self.manifest.previousKind(dest_file) == 'copy':
+                os.remove(dest_file)
+        os.symlink(target,dest_file)
+        statCache.invalidate(dest_file)
+        self.manifest.add(dest_file,'link',target)
+
+    @profiled('copy')
+    def _copy(self,src,dest_file,move=False,method=None):
+        """Copy (or move) a file unless an identical copy was left in place by the previous setup"""
+        stat = None
+        if not move:
+            src_stat = statCache.stat(src)
+            stat = [src_stat.st_size,src_stat.st_mtime]
+        if self.incremental:
+            if not move and self.manifest.unchanged(dest_file,'copy',src,stat):
+                self.manifest.add(dest_file,'copy',src,stat)
+                return
+            if os.path.islink(dest_file): os.remove(dest_file)
+        if move:
+            shutil.move(src,dest_file)
+            statCache.invalidate(src)
+        else:
+            method = fileCopier.copy(src,dest_file,method=method and method or self.copy_method)
+            if (int(self.verbosity) >= 2): print "Info 2: copy method used for "+dest_file+": "+method
+        statCache.invalidate(dest_file)
+        self.manifest.add(dest_file,'copy',src,stat)
+
+    def _removeStale(self):
+        """Remove entries created by the previous setup that are no longer requested"""
+        for (dest,kind) in self.manifest.stale():
+            try:
+                if kind == 'directory':
+                    if os.path.isdir(dest) and not os.path.islink(dest): os.rmdir(dest)
+                elif os.path.islink(dest) or (kind == 'copy' and os.path.isfile(dest)):
+                    os.remove(dest)
+                else:
+                    continue
+                if (self.verbosity): print "Info 1: removed "+kind+" "+dest.replace(self.taskdir,'')+" from the previous setup"
+            except OSError:
+                print "Warning: unable to remove "+kind+" "+dest+" from the previous setup"
+
+    def _digest(self):
+        """Return a digest of the configuration and the namespace in which it is resolved"""
+        digest = hashlib.md5(''.join(self.configData))
+        namespace = self.set and self.set or os.environ
+        for key in sorted(namespace.keys()):
+            digest.update(key+'='+namespace[key]+'\n')
+        return(digest.hexdigest())
+
+    def _linkEntry(self,section,abs_subdir,entry):
+        """Perform linking operations for a single section entry"""
+        status = self.ok
+        if (int(self.verbosity) >= 2): startTime=time()
+        line = LinkFile(entry.link,entry.target_host,entry.target,entry.link_only,verbosity=self.verbosity,
+                        expansion=self.expansion)
+        if len(line.target) == 0:
+            print "Error: empty target for "+line.link+" ... skipping"
+            return(self.error)
+        link_only = entry.link_only
+        dest = os.path.join(abs_subdir,entry.link)
+        if not os.path.isdir(os.path.dirname(dest)):
+            mkdir_p(os.path.dirname(dest))                    
+        if os.path.islink(dest) and not self.incremental: os.remove(dest)
+        dest_is_dir = False
+        if len(line.src) == 0:
+            line.rephost()
+        elif entry.target_type == 'directory' and not link_only or len(line.src) > 1:
+            dest_is_dir = True
+            if os.path.islink(dest): os.remove(dest)
+            if not os.path.isdir(dest):
+                try:
+                    mkdir_p(dest)
+                except OSError:
+                    print "Error: could not create "+section+" subdirectory "+dest
+                    dest_is_dir = False
+                    status = self.error
+            if dest_is_dir: self.manifest.add(dest,'directory','')
+                            
+        # Process each file on the line separately
+        for i in range(len(line.src)-1,-1,-1):
+
+            # Retrieve information about the source file
+            true_src_file = line.true_src_file[i]
+            src_file_prefix = line.src_file_prefix[i]
+
+            # Retrieve information about the destination
+            if dest_is_dir and not link_only:
+                dest_file = os.path.join(dest,os.path.basename(line.src[i]))
+            else:
+                dest_file = dest
+            dest_path_short = dest_file.replace(self.taskdir,'')
+
+            # Check that the source file information is valid
+            if not true_src_file:
+                print "Error: skipping entry because no source file given for "+dest_path_short
+                status = self.error
+                continue
+
+            # Take care of creating directory links
+            if line.local_file_type[i] == 'directory' or line.remote_file_type[i] is 'directory':
+                if entry.target_type != 'directory':
+                    if (self.verbosity): print "Warning: "+entry.target_type+" link "+entry.link+ \
+                       " refers to a directory target "+str(entry.target)                                
+                if os.path.islink(dest_file) and not self.incremental:
+                    print "Warning: updating directory link to "+dest_path_short+" => "+src_file_prefix+true_src_file+" (previous target was "+os.readlink(dest_file)+")"
+                    os.remove(dest_file)
+                try:
+                    self._symlink(path2host(line.host[i],true_src_file),dest_file)
+                    if (self.verbosity): print "Info 1: linked directory "+dest_path_short+" => "+src_file_prefix+true_src_file
+                except IOError:
+                    print "Error: error creating symlink for directory "+dest_path_short+" => "+src_file_prefix+true_src_file
+                    status = self.error
+                except OSError:
+                    status = self.error
+                    if os.path.isdir(dest_file) and link_only:
+                        print "Error: multiple entries for "+dest_path_short+" in the "+section+" section are not supported"
+                    else:
+                        raise
+
+            # Take care of creating file links or copies
+            else:                        
+                isfile = True
+                if line.remote_file_type[i] is not 'file':
+                    isfile = line.local_file_type[i] == 'file' and os.access(true_src_file,os.R_OK)
+                if isfile and entry.target_type != 'file' and len(line.src) == 1:
+                    if (self.verbosity): print "Warning: "+entry.target_type+" link "+entry.link+ \
+                       "/ refers to a file target "+str(entry.target)
+                if isfile or link_only:
+                    try:
+                        if entry.copy and not link_only and not line.host[i]:
+                            if entry.cleanup:
+                                self._copy(true_src_file,dest_file,move=True)
+                                link_type = "moved"
+                            else:
+                                self._copy(true_src_file,dest_file,method=entry.copy_method)
+                                link_type = "copied"
+                        else:
+                            if entry.create_target:
+                                status_create = self._createTarget(entry,line.host[i],true_src_file)
+                                if status == self.ok: status = status_create
+                                true_src_file = getTruePath(true_src_file,self.verbosity)
+                                if true_src_file == "":
+                                   print "Error: attempting to create link to empty target string."
+                                   status = self.error
+                            if os.path.islink(dest_file) and not self.incremental:
+                                print "Warning: updating file link to "+dest_path_short+" => "+src_file_prefix+true_src_file+" (previous target was "+os.readlink(dest_file)+")"
+                                os.remove(dest_file)
+                            self._symlink(path2host(line.host[i],true_src_file),dest_file)
+                            link_type = "linked"
+                        if (self.verbosity): print "Info 1: "+link_type+" file "+dest_path_short+" => "+src_file_prefix+true_src_file
+                    except OSError:
+                        print "Error: error creating symlink for file "+dest_path_short+" => "+src_file_prefix+true_src_file
+                        raise
+                        status = self.error
+                else:
+                    print "Error: unable to link "+dest_path_short+" => "+src_file_prefix+true_src_file+" ... source file is unavailable"
+                    status = self.error
+        if (int(self.verbosity) >= 2): print("Info 2: Link creation time: " + str( time() - startTime))
+        return(status)
+
     def link(self):
         """Perform subdirectory creation and linking operations"""
-        have_subprocess=True
-        try:
-            import subprocess
-        except ImportError:
-            have_subprocess=False
         status = self.ok
+        statCache.reset()
         sub_status = self._taskdir_setup()
         if sub_status != self.ok: return(sub_status)
+        setup_dir = os.path.join(self.taskdir,self._map('setup'))
+        self.manifest = Manifest(self.taskdir,digest=self._digest())
+        if self.incremental:
+            self.manifest.load(setup_dir)
+            if (self.verbosity) and self.manifest.digest == self.manifest.previous_digest:
+                print "Info 1: configuration and namespace unchanged since the previous setup"
+        self._expandRemoteTargets()
+        self._createRemoteTargets()
         for section in self["sections"].keys():
             if (self.verbosity): print "  <"+section+">"
             abs_subdir = os.path.join(self.taskdir,self._map(section))
             sub_status = self._subdir_setup(abs_subdir)
             if sub_status != self.ok: return(sub_status)
-            for entry in self["sections"][section]:
-                if (int(self.verbosity) >= 2): startTime=time()
-                line = LinkFile(entry["link"],entry["target_host"],entry["target"],entry["link_only"],verbosity=self.verbosity)
-                if len(line.target) == 0:
-                    print "Error: empty target for "+line.link+" ... skipping"
-                    status = self.error
-                    continue
-                link_only = entry["link_only"]
-                dest = os.path.join(abs_subdir,entry["link"])
-                if not os.path.isdir(os.path.dirname(dest)):
-                    mkdir_p(os.path.dirname(dest))                    
-                if os.path.islink(dest): os.remove(dest)
-                dest_is_dir = False
-                if len(line.src) == 0:
-                    line.rephost()
-                elif entry["target_type"] == 'directory' and not link_only or len(line.src) > 1:
-                    dest_is_dir = True
-                    if not os.path.isdir(dest):
-                        try:
-                            mkdir_p(dest)
-                        except OSError:
-                            print "Error: could not create "+section+" subdirectory "+dest
-                            dest_is_dir = False
-                            status = self.error
-                            
-                # Process each file on the line separately
-                for i in range(len(line.src)-1,-1,-1):
+            with profiler.span('section:'+section):
+                for entry_status in self._linkSection(section,abs_subdir):
+                    if entry_status != self.ok: status = entry_status
+            if (self.verbosity): print "  </"+section+">"
+        if self.incremental: self._removeStale()
+        self.manifest.write(setup_dir)
+        profiler.write(setup_dir)
+        return(status)
 
-                    # Retrieve information about the source file
-                    true_src_file = line.true_src_file[i]
-                    src_file_prefix = line.src_file_prefix[i]
+class ServerStream(object):
+    """Output stream that forwards writes to a task_setup_client connection"""
 
-                    # Retrieve information about the destination
-                    if dest_is_dir and not link_only:
-                        dest_file = os.path.join(dest,os.path.basename(line.src[i]))
-                    else:
-                        dest_file = dest
-                    dest_path_short = dest_file.replace(self.taskdir,'')
+    def __init__(self,connection,name):
+        """Class constructor"""
+        self.connection = connection
+        self.name = name
+        self.softspace = 0
 
-                    # Check that the source file information is valid
-                    if not true_src_file:
-                        print "Error: skipping entry because no source file given for "+dest_path_short
-                        status = self.error
-                        continue
+    def write(self,text):
+        """Send text to the client (output is dropped once the client has gone away)"""
+        self.connection.lock.acquire()
+        try:
+            if not self.connection.alive: return
+            try:
+                self.connection.fd.write(json.dumps({'stream':self.name,'text':text.decode('latin-1')})+'\n')
+                self.connection.fd.flush()
+            except (IOError,OSError,socket.error):
+                self.connection.alive = False
+        finally:
+            self.connection.lock.release()
 
-                    # Take care of creating directory links
-                    if os.path.isdir(true_src_file) or line.remote_file_type[i] is 'directory':
-                        if entry["target_type"] != 'directory':
-                            if (self.verbosity): print "Warning: "+entry["target_type"]+" link "+entry["link"]+ \
-                               " refers to a directory target "+str(entry["target"])                                
-                        if os.path.islink(dest_file):
-                            print "Warning: updating directory link to "+dest_path_short+" => "+src_file_prefix+true_src_file+" (previous target was "+os.readlink(dest_file)+")"
-                            os.remove(dest_file)
-                        try:
-                            os.symlink(path2host(line.host[i],true_src_file),dest_file)
-                            if (self.verbosity): print "Info 1: linked directory "+dest_path_short+" => "+src_file_prefix+true_src_file
-                        except IOError:
-                            print "Error: error creating symlink for directory "+dest_path_short+" => "+src_file_prefix+true_src_file
-                            status = self.error
-                        except OSError:
-                            status = self.error
-                            if os.path.isdir(dest_file) and link_only:
-                                print "Error: multiple entries for "+dest_path_short+" in the "+section+" section are not supported"
-                            else:
-                                raise
+    def flush(self):
+        """Output is sent as it is written"""
+        pass
 
-                    # Take care of creating file links or copies
-                    else:                        
-                        isfile = True
-                        if line.remote_file_type[i] is not 'file':
-                            try:
-                                fd = open(true_src_file,'r')
-                            except IOError:
-                                isfile = False
-                        if isfile and entry["target_type"] != 'file' and len(line.src) == 1:
-                            if (self.verbosity): print "Warning: "+entry["target_type"]+" link "+entry["link"]+ \
-                               "/ refers to a file target "+str(entry["target"])
-                        if isfile or link_only:
-                            try:
-                                if entry["copy"] and not link_only:
-                                    if entry["cleanup"]:
-                                        shutil.move(true_src_file,dest_file)
-                                        link_type = "moved"
-                                    else:
-                                        shutil.copyfile(true_src_file,dest_file)
-                                        link_type = "copied"
-                                else:
-                                    if entry["create_target"]:
-                                        status_create = self._createTarget(entry,line.host[i],true_src_file)
-                                        if status == self.ok: status = status_create
-                                        true_src_file = getTruePath(true_src_file,self.verbosity)
-                                        if true_src_file == "":
-                                           print "Error: attempting to create link to empty target string."
-                                           status = self.error
-                                    if os.path.islink(dest_file):
-                                        print "Warning: updating file link to "+dest_path_short+" => "+src_file_prefix+true_src_file+" (previous target was "+os.readlink(dest_file)+")"
-                                        os.remove(dest_file)
-                                    os.symlink(path2host(line.host[i],true_src_file),dest_file)
-                                    link_type = "linked"
-                                if (self.verbosity): print "Info 1: "+link_type+" file "+dest_path_short+" => "+src_file_prefix+true_src_file
-                            except OSError:
-                                print "Error: error creating symlink for file "+dest_path_short+" => "+src_file_prefix+true_src_file
-                                raise
-                                status = self.error
-                        else:
-                            print "Error: unable to link "+dest_path_short+" => "+src_file_prefix+true_src_file+" ... source file is unavailable"
-                            status = self.error
-                if (int(self.verbosity) >= 2): print("Info 2: Link creation time: " + str( time() - startTime))
-            if (self.verbosity): print "  </"+section+">"
-        return(status)
+class SetupServer(object):
+    """Resident process that performs task setups requested by task_setup_client"""
 
-# Executable segment
-if __name__ == "__main__":
+    # Class variables
+    idle_timeout = int(os.environ.get('TASK_SETUP_SERVER_IDLE','3600'))  #Exit after this many seconds without requests
+    request_timeout = int(os.environ.get('TASK_SETUP_SERVER_TIMEOUT','1800')) #Restart after a setup runs this many seconds
+
+    def __init__(self,address):
+        """Class constructor"""
+        self.address = address
+        self.sock = None
+
+    def _bind(self):
+        """Create the listening socket, returning False if another server is running"""
+        directory = os.path.dirname(self.address)
+        try:
+            os.mkdir(directory,0700)
+        except OSError:
+            if sys.exc_info()[1].errno != errno.EEXIST: raise
+        if os.stat(directory).st_uid != os.getuid():
+            print "Error: server directory "+directory+" is not owned by the current user"
+            return(False)
+        probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+            print "Error: a task_setup server is already listening on "+self.address
+            return(False)
+        except socket.error:
+            pass
+        finally:
+            probe.close()
+        if os.path.exists(self.address): os.unlink(self.address)
+        self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self.sock.bind(self.address)
+        os.chmod(self.address,0600)
+        self.sock.listen(64)
+        self._closeOnExec(self.sock)
+        return(True)
+
+    def _closeOnExec(self,sock):
+        """Keep the commands started by the setups from holding a server socket open"""
+        import fcntl
+        fcntl.fcntl(sock.fileno(),fcntl.F_SETFD,fcntl.fcntl(sock.fileno(),fcntl.F_GETFD)|fcntl.FD_CLOEXEC)
+
+    def _reset(self):
+        """Discard the state that is only valid for the duration of a single setup"""
+        tempfile.tempdir = None
+        truePathResolver.reset()
+        statCache.reset()
+        pathIndex.clear()
+        remoteSessions.prune()
+
+    def _handle(self,conn):
+        """Perform the setup described by a single client request"""
+        connection = Store()
+        connection.fd = conn.makefile('rwb')
+        connection.alive = True
+        connection.lock = threading.Lock()
+        try:
+            request = json.loads(connection.fd.readline())
+            argv = [arg.encode('latin-1') for arg in request['argv']]
+            environ = dict([(key.encode('latin-1'),value.encode('latin-1')) for (key,value) in request['environ'].items()])
+            # The client runs the setup itself unless it confirms that the server should go ahead
+            connection.fd.write(json.dumps({'ready':True})+'\n')
+            connection.fd.flush()
+            if connection.fd.readline().strip() != 'go': return
+        except (ValueError,KeyError,TypeError,AttributeError,IOError,OSError,socket.error):
+            return
+        watchdog = threading.Timer(self.request_timeout,self._expire,[connection])
+        watchdog.setDaemon(True)
+        watchdog.start()
+        saved = (dict(os.environ),os.getcwd(),sys.argv,sys.stdout,sys.stderr)
+        umask = os.umask(request.get('umask',022))
+        try:
+            os.environ.clear()
+            os.environ.update(environ)
+            sys.argv = argv
+            sys.stdout = ServerStream(connection,'stdout')
+            sys.stderr = ServerStream(connection,'stderr')
+            try:
+                os.chdir(request['cwd'].encode('latin-1'))
+                self._reset()
+                status = main(argv[1:],server=True)
+            except SystemExit:
+                status = sys.exc_info()[1].code
+            except:
+                import traceback
+                traceback.print_exc()
+                status = 1
+        finally:
+            watchdog.cancel()
+            (environ,cwd,sys.argv,sys.stdout,sys.stderr) = saved
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+            os.umask(umask)
+        self._reply(connection,{'status':status})
+
+    def _reply(self,connection,reply):
+        """Send a final reply to the client, after which its output is dropped"""
+        connection.lock.acquire()
+        try:
+            if not connection.alive: return
+            connection.alive = False
+            try:
+                connection.fd.write(json.dumps(reply)+'\n')
+                connection.fd.flush()
+            except (IOError,OSError,socket.error):
+                pass
+        finally:
+            connection.lock.release()
+
+    def _expire(self,connection):
+        """Fail a setup that has run for too long and restart the server, whose state can no longer be trusted"""
+        message = "Error: the setup did not complete within "+str(self.request_timeout)+" seconds in the task_setup server\n"
+        ServerStream(connection,'stderr').write(message)
+        self._reply(connection,{'status':1})
+        sys.__stderr__.write(message+"Info 1: restarting the task_setup server\n")
+        sys.__stderr__.flush()
+        # Closing every descriptor lets the client, the remote channels and the shells see the end of their streams
+        os.closerange(3,os.sysconf('SC_OPEN_MAX'))
+        os.execve(sys.executable,[sys.executable]+self.argv,self.environ)
+
+    def serve(self):
+        """Answer setup requests one at a time until the server has been idle for too long"""
+        if not self._bind(): return(1)
+        import signal
+        signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+        self.argv = [os.path.abspath(sys.argv[0])]+sys.argv[1:]
+        self.environ = dict(os.environ)
+        print "Info 1: task_setup server listening on "+self.address
+        sys.stdout.flush()
+        self.sock.settimeout(self.idle_timeout)
+        try:
+            while True:
+                try:
+                    (conn,peer) = self.sock.accept()
+                except socket.timeout:
+                    break
+                conn.settimeout(None)
+                self._closeOnExec(conn)
+                try:
+                    self._handle(conn)
+                finally:
+                    conn.close()
+        finally:
+            self.sock.close()
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+        return(0)
+
+def userDirectory(create=False):
+    """Return the per-user directory for the files that task_setup shares between runs (None if unusable)"""
+    directory = os.path.join(os.environ.get('TMPDIR','/tmp'),'task_setup-'+str(os.getuid()))
+    if not create: return(directory)
+    try:
+        os.mkdir(directory,0700)
+    except OSError:
+        if sys.exc_info()[1].errno != errno.EEXIST: return(None)
+    try:
+        if os.stat(directory).st_uid != os.getuid(): return(None)
+    except OSError:
+        return(None)
+    return(directory)
+
+def serverAddress():
+    """Return the per-user, per-host socket address of the task_setup server (see task_setup_client)"""
+    address = os.environ.get('TASK_SETUP_SERVER','')
+    if '/' in address: return(address)
+    return(os.path.join(userDirectory(),socket.gethostname()+'.sock'))
+
+def main(argv=None,server=False):
+    """Perform a task setup as requested on the command line, returning the exit status"""
 
     # Command line argument parsing
     usage = "%prog [options] CONFIG_FILE"
@@ -1035,15 +2979,52 @@ if __name__ == "__main__":
                       help="verbose runtime output",default=0)
     parser.add_option("-c","--clean",dest="clean",action="store_true",
                       help="clean task directory before setup",default=False)
+    parser.add_option("","--clean-mode",dest="cleanmode",type="choice",choices=['remove','trash'],default='remove',
+                      help="cleanup MODE: 'remove' old subdirectories in place or move them to a 'trash' area deleted in the background",metavar="MODE")
+    parser.add_option("","--reap-trash",dest="reaptrash",action="store_true",
+                      help="delete the trash left next to the task base directory and exit",default=False)
+    parser.add_option("-i","--incremental",dest="incremental",action="store_true",
+                      help="update the task directory from the manifest of the previous setup",default=False)
+    parser.add_option("","--copy-method",dest="copymethod",type="choice",choices=['auto']+FileCopier.methods,default='auto',
+                      help="default METHOD for copy entries: auto, hardlink, reflink, range or stream (auto)",metavar="METHOD")
     parser.add_option("-r","--force",dest="force",action="store_true",
                       help="force action (ignore warnings)",default=False)
     parser.add_option("-e","--environment",dest="environment",default=None,
                       help="text FILE containing the set namespace in which to run",metavar="FILE")
     parser.add_option("","--varcache",dest="varcache",default=None,
                       help="text FILE containing a 'sourceable' version of the set namespace",metavar="FILE")    
+    parser.add_option("-j","--jobs",dest="jobs",type="int",default=1,
+                      help="link up to N section entries concurrently",metavar="N")
+    parser.add_option("","--cache-dir",dest="cachedir",default=os.environ.get('TASK_SETUP_CACHE_DIR'),
+                      help="DIRECTORY in which to cache results between runs",metavar="DIRECTORY")
+    parser.add_option("","--cache-size",dest="cachesize",type="int",default=10000,
+                      help="maximum number of cached results of each type in the cache directory",metavar="N")
+    parser.add_option("","--batch",dest="batch",default=None,
+                      help="set up the tasks listed in FILE as lines of 'CONFIG_FILE DIRECTORY [SET_FILE [VARCACHE_FILE]]' (set and variable cache files are copied, not moved)",metavar="FILE")
+    parser.add_option("","--profile",dest="profile",action="store_true",
+                      help="write a timing summary of the setup phases to the .setup subdirectory",default=False)
+    parser.add_option("","--profile-trace",dest="trace",action="store_true",
+                      help="also write a Chrome trace-event file of the setup to the .setup subdirectory",default=False)
+    parser.add_option("","--server",dest="server",action="store_true",
+                      help="run as a resident server for task_setup_client requests",default=False)
+    parser.add_option("","--plan",dest="plan",action="store_true",
+                      help="print a JSON description of the setup without acting on it or evaluating embedded commands",default=False)
+    parser.add_option("","--plan-exec",dest="planexec",action="store_true",
+                      help="evaluate embedded commands when planning",default=False)
+    parser.add_option("","--plan-stat",dest="planstat",action="store_true",
+                      help="expand and check local targets when planning",default=False)
+    parser.add_option("","--plan-remote",dest="planremote",action="store_true",
+                      help="expand and check remote targets when planning",default=False)
     parser.add_option("-d","--dry-run",dest="dryrun",action="store_true",
                       help="handle configuration file without acting on it",default=False)
-    (options,args) = parser.parse_args()
+    (options,args) = parser.parse_args(argv)
+
+    # Start a resident server
+    if options.server:
+        if server:
+            print "Error: a task_setup server cannot be started through task_setup_client"
+            return(1)
+        return(SetupServer(serverAddress()).serve())
 
     # Ensure that the user has provided a configuration file
     try:
@@ -1051,25 +3032,108 @@ if __name__ == "__main__":
     except IndexError:
         cfgFile = None
 
+    # Wait for the deletion of old task subdirectories
+    if options.reaptrash:
+        Trash(options.basedir).reap(wait=True)
+        return(0)
+
+    # Attach the caches shared between runs
+    for (cache,prefix) in ((embeddedCache,'embedded'),(namespaceCache,'namespace'),(pathIndex,'pathindex'),(configCache,'config')):
+        cache.disk = (options.cachedir) and DiskCache(options.cachedir,prefix,max_entries=options.cachesize) or None
+    # Variable caches are always shared so that tasks sourcing the same configuration generate them once
+    directory = options.cachedir or userDirectory(create=True)
+    varcacheCache.disk = (directory) and DiskCache(directory,'varcache',max_entries=options.cachesize) or None
+
+    # Set up all of the task directories listed in a batch file
+    if options.batch:
+        return(batch(options))
+
     # Read, parse and act on configuration file for task setup
+    return(setup(options,cfgFile,options.basedir,options.environment,options.varcache))
+
+def setup(options,cfgFile,basedir,setFile=None,varcache=None,remote_expansions=None,keep_inputs=False):
+    """Read, parse and act on a configuration file to set up a task directory, returning the exit status"""
+    global undef_list
     undef_list = Store()
-    cfg = Config(file=cfgFile,taskdir=options.basedir,set=options.environment,varcache=options.varcache)
-    cfg.setOption('cleanup',options.clean)
-    cfg.setOption('force',options.force)
-    cfg.setOption('verbosity',options.verbose)
-    if cfg.getSections():
+    profiler.reset(enabled=options.profile,trace=options.trace)
+    # Messages go to STDERR when the plan is written to STDOUT
+    stdout = sys.stdout
+    if options.plan: sys.stdout = sys.stderr
+    try:
+        cfg = Config(file=cfgFile,taskdir=basedir,set=setFile,varcache=varcache,tmpfiles=not options.plan)
+        cfg.setOption('cleanup',options.clean)
+        cfg.setOption('force',options.force)
+        cfg.setOption('verbosity',options.verbose)
+        cfg.setOption('jobs',options.jobs)
+        cfg.setOption('incremental',options.incremental)
+        cfg.setOption('clean_mode',options.cleanmode)
+        cfg.setOption('copy_method',options.copymethod)
+        cfg.setOption('remote_expansions',remote_expansions)
+        cfg.setOption('keep_inputs',keep_inputs)
+        cfg.setOption('execute',not options.plan or options.planexec)
+        sections = cfg.getSections()
+        if options.plan and sections: plan = cfg.plan(stat=options.planstat,remote=options.planremote)
+    finally:
+        sys.stdout = stdout
+    if sections:
         pass
     else:
         if cfg.verbosity: print " *** Error: task_setup.py unable to continue *** "
-        sys.exit(1)
+        return(1)
     if options.dryrun:
         cfg.write(sys.stdout)
         del cfg
-        sys.exit(0)
+        return(0)
+    if options.plan:
+        json.dump(plan,sys.stdout,indent=1)
+        sys.stdout.write('\n')
+        del cfg
+        return(0)
     if cfg.link():
         del cfg
-	sys.exit(0)
+        return(0)
     else:
         if cfg.verbosity: print " *** Error: problematic completion from task_setup.py *** "
         del cfg
-	sys.exit(1)
+        return(1)
+
+def batch(options):
+    """Set up the task directories listed in a batch file, returning a non-zero status if any setup failed"""
+    try:
+        fd = open(options.batch,'rb')
+        try:
+            lines = fd.readlines()
+        finally:
+            fd.close()
+    except IOError:
+        print "Error: unable to read batch file "+options.batch
+        return(1)
+    tasks = []
+    for line in lines:
+        fields = shlex.split(line,comments=True)
+        if not fields: continue
+        if len(fields) < 2 or len(fields) > 4:
+            print "Error: invalid batch file entry: "+line.rstrip('\n')
+            return(1)
+        tasks.append(fields+[None for i in range(len(fields),4)])
+    remote_expansions = {}
+    failed = 0
+    for (cfgFile,basedir,setFile,varcache) in tasks:
+        try:
+            # Set and variable cache files may be shared by several lines, so they are copied rather than moved
+            status = setup(options,cfgFile,basedir,setFile,varcache,remote_expansions=remote_expansions,keep_inputs=True)
+        except SystemExit:
+            status = sys.exc_info()[1].code
+        except:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        if status: failed += 1
+        print "Info 1: batch setup of "+basedir+" from "+cfgFile+" completed with status "+str(status)
+        sys.stdout.flush()
+    if failed and options.verbose: print " *** Error: "+str(failed)+" of "+str(len(tasks))+" batch setups failed *** "
+    return(failed and 1 or 0)
+
+# Executable segment
+if __name__ == "__main__":
+    sys.exit(main())